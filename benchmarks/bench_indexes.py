@@ -0,0 +1,49 @@
+"""Time the admin list pages on a synthetic course before and after migrate-db creates the indexes.
+
+Run from the repository root as (1M jobs)::
+
+  python -m benchmarks.bench_indexes --students 500 --exercises 20 --pipelines 25 --jobs 4
+"""
+
+import argparse
+from tempfile import TemporaryDirectory
+
+from benchmarks.common import invoke, make_app, timed_get
+from benchmarks.fake_gitlab import Course
+from benchmarks.synthetic import generate
+
+PAGES = [
+  '/student/', '/exercise/', '/solution/', '/pipeline/', '/allstudent/', '/allsolution/', '/job/',
+  '/solution/?sort=0', '/solution/?flt0_status_equals=success', '/pipeline/?sort=0&desc=1',
+]
+
+
+def main():
+  parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+  parser.add_argument('--students', type = int, default = 100)
+  parser.add_argument('--exercises', type = int, default = 10)
+  parser.add_argument('--pipelines', type = int, default = 10)
+  parser.add_argument('--jobs', type = int, default = 4)
+  args = parser.parse_args()
+
+  from gsm import cli
+  from gsm.models import db
+  with TemporaryDirectory() as workdir:
+    app = make_app(workdir)
+    app.extensions['gsm_page_cache'].size = 0
+    client = app.test_client()
+    with app.app_context():
+      db.drop_all()
+      db.create_all()
+      generate(Course(args.students, args.exercises, args.pipelines, args.jobs))
+      indexes = [index for table in db.metadata.sorted_tables for index in table.indexes]
+      for index in indexes: index.drop(db.engine)
+      before = {page: timed_get(client, page) for page in PAGES}
+      invoke(app, cli.migrate_db)
+      after = {page: timed_get(client, page) for page in PAGES}
+  print(f'{"page":40s} {"before":>9s} {"after":>9s}')
+  for page in PAGES: print(f'{page:40s} {before[page] * 1000:7.1f}ms {after[page] * 1000:7.1f}ms')
+
+
+if __name__ == '__main__':
+  main()
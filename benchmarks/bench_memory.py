@@ -0,0 +1,63 @@
+"""Measure the peak memory allocated by the sync commands as the history grows.
+
+For every number of pipelines per solution, a synthetic course is generated
+into a new database and the fake GitLab serves the very same course, so the
+commands find nothing new: what they allocate is what they keep about the
+history. Run from the repository root as::
+
+  python -m benchmarks.bench_memory --students 10 --exercises 10 --pipelines 10 30 90
+"""
+
+import argparse
+import gc
+import tracemalloc
+from tempfile import TemporaryDirectory
+
+from benchmarks.common import invoke, make_app
+from benchmarks.fake_gitlab import Course, FakeGitLab
+from benchmarks.synthetic import generate
+
+COMMANDS = [
+  ('sync', ()),
+  ('update_pipelines', ('--full', )),
+  ('update_jobs', ()),
+  ('update_jobs', ('--full', )),
+]
+
+
+def peak_memory(app, command, *args):
+  gc.collect()
+  tracemalloc.start()
+  try:
+    invoke(app, command, *args)
+    return tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+
+
+def main():
+  parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+  parser.add_argument('--students', type = int, default = 20)
+  parser.add_argument('--exercises', type = int, default = 10)
+  parser.add_argument('--pipelines', type = int, nargs = '+', default = [10, 30, 90], help = 'Numbers of pipelines per solution to try (at most 99).')
+  parser.add_argument('--jobs', type = int, default = 4)
+  parser.add_argument('--workers', type = int, default = 4)
+  args = parser.parse_args()
+
+  from gsm import cli
+  from gsm.models import db
+  print(f'{"pipelines":>10s} {"jobs":>10s} ' + ' '.join(f'{name + " " + " ".join(extra):>24s}' for name, extra in COMMANDS))
+  for pipelines in args.pipelines:
+    course = Course(args.students, args.exercises, pipelines, args.jobs)
+    with FakeGitLab(course) as server, TemporaryDirectory() as workdir:
+      app = make_app(workdir, server, CONCURRENCY = args.workers)
+      with app.app_context():
+        db.create_all()
+        generate(course)
+        peaks = [peak_memory(app, getattr(cli, name), *extra) for name, extra in COMMANDS]
+    total = args.students * args.exercises * pipelines
+    print(f'{total:10d} {total * args.jobs:10d} ' + ' '.join(f'{peak / 2**20:21.1f} MB' for peak in peaks))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,49 @@
+"""Compare the serial and the concurrent update_pipelines against a fake GitLab.
+
+Run from the repository root as::
+
+  python -m benchmarks.bench_pipelines --students 30 --latency 0.02 --workers 8
+"""
+
+import argparse
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from benchmarks.common import invoke, make_app
+from benchmarks.fake_gitlab import Course, FakeGitLab
+
+
+def main():
+  parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+  parser.add_argument('--students', type = int, default = 20)
+  parser.add_argument('--exercises', type = int, default = 5)
+  parser.add_argument('--pipelines', type = int, default = 4)
+  parser.add_argument('--latency', type = float, default = 0.02)
+  parser.add_argument('--workers', type = int, default = 8)
+  args = parser.parse_args()
+
+  from gsm import cli
+  from gsm.models import DiscardedPipeline, Pipeline, SolutionSync, db
+  course = Course(args.students, args.exercises, args.pipelines)
+  with FakeGitLab(course, args.latency) as server, TemporaryDirectory() as workdir:
+    app = make_app(workdir, server)
+    with app.app_context():
+      invoke(app, cli.init_db)
+      invoke(app, cli.update_students)
+      invoke(app, cli.update_exercises, app.config['BENCHMARK_EXERCISES'])
+      invoke(app, cli.update_solutions)
+      timings = {}
+      for workers in (1, args.workers):
+        db.session.execute(db.delete(Pipeline))
+        db.session.execute(db.delete(DiscardedPipeline))
+        db.session.execute(db.delete(SolutionSync))
+        db.session.commit()
+        start = perf_counter()
+        invoke(app, cli.update_pipelines, '--workers', str(workers))
+        timings[workers] = perf_counter() - start
+        print(f'{workers:3d} workers: {timings[workers]:.2f}s, {db.session.scalar(db.select(db.func.count(Pipeline.id)))} pipelines')
+  print(f'Speedup: {timings[1] / timings[args.workers]:.1f}x')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,98 @@
+"""Measure the startup time and the memory of the web workers.
+
+Every measure runs in a fresh interpreter, as a gunicorn worker would: the
+import of gsm and create_app() are timed, a few pages of a synthetic course
+are served and the memory of the process is reported, together with which
+modules of the GitLab and CLI stack got imported. The same is then done as
+with gunicorn --preload: the app is created once and --workers processes are
+forked from it, each serving the pages; their private memory (the one not
+shared with the parent) is what every further worker costs. Linux only, run
+from the repository root as::
+
+  python -m benchmarks.bench_startup --workers 4
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from benchmarks.common import make_app
+from benchmarks.fake_gitlab import Course
+from benchmarks.synthetic import generate
+
+PAGES = ['/', '/student/', '/exercise/', '/solution/', '/analytics/']
+STACK = ['gitlab', 'tqdm', 'gsm.cli', 'gsm.scheduler']
+
+
+def memory():
+  """Returns the resident and the private memory of this process, in MB."""
+  fields = dict(line.split(':', 1) for line in Path('/proc/self/smaps_rollup').read_text().splitlines()[1:])
+  return tuple(sum(int(fields[name].split()[0]) for name in names) / 1024 for names in (['Rss'], ['Private_Clean', 'Private_Dirty']))
+
+def serve(app):
+  client = app.test_client()
+  for page in PAGES:
+    if client.get(page).status_code != 200: raise RuntimeError(f'GET {page} failed')
+
+def child(mode, workdir, workers):
+  start = perf_counter()
+  app = make_app(workdir)
+  startup = perf_counter() - start
+  result = dict(startup = startup, stack = [module for module in STACK if module in sys.modules])
+  if mode == 'fresh':
+    serve(app)
+    result['rss'], result['private'] = memory()
+  else:
+    result['rss'] = memory()[0]
+    pipes = []
+    for _ in range(workers):
+      read, write = os.pipe()
+      if os.fork() == 0:
+        serve(app)
+        os.write(write, json.dumps(memory()).encode())
+        os._exit(0)
+      os.close(write)
+      pipes.append(read)
+    privates = [json.loads(os.read(read, 1024))[1] for read in pipes]
+    for _ in range(workers): os.wait()
+    result['private'] = max(privates)
+  print(json.dumps(result))
+
+def run(mode, workdir, workers):
+  output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_startup', '--child', mode, '--workdir', workdir, '--workers', str(workers)], check = True, capture_output = True, text = True).stdout
+  return json.loads(output.splitlines()[-1])
+
+
+def main():
+  parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+  parser.add_argument('--students', type = int, default = 50)
+  parser.add_argument('--exercises', type = int, default = 10)
+  parser.add_argument('--pipelines', type = int, default = 10)
+  parser.add_argument('--workers', type = int, default = 4)
+  parser.add_argument('--repeat', type = int, default = 3)
+  parser.add_argument('--child', choices = ['fresh', 'preload'], help = argparse.SUPPRESS)
+  parser.add_argument('--workdir', help = argparse.SUPPRESS)
+  args = parser.parse_args()
+  if args.child: return child(args.child, args.workdir, args.workers)
+
+  with TemporaryDirectory() as workdir:
+    app = make_app(workdir)
+    from gsm.models import db
+    with app.app_context():
+      db.create_all()
+      generate(Course(args.students, args.exercises, args.pipelines, 4))
+    fresh = min((run('fresh', workdir, args.workers) for _ in range(args.repeat)), key = lambda result: result['startup'])
+    preload = run('preload', workdir, args.workers)
+  print(f'startup (import and create_app): {fresh["startup"] * 1000:.0f} ms, GitLab/CLI modules imported: {", ".join(fresh["stack"]) or "none"}')
+  print(f'{"":>10s} {"parent RSS":>12s} {"per worker":>12s} {f"{args.workers} workers":>12s}')
+  print(f'{"fresh":>10s} {"":>12s} {fresh["private"]:9.1f} MB {fresh["private"] * args.workers:9.1f} MB')
+  print(f'{"preload":>10s} {preload["rss"]:9.1f} MB {preload["private"]:9.1f} MB {preload["rss"] + preload["private"] * args.workers:9.1f} MB')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,54 @@
+"""Helpers to run gsm against a fake GitLab from a throwaway instance directory."""
+
+from os import environ
+from pathlib import Path
+from time import perf_counter
+
+from benchmarks.fake_gitlab import GROUP_ID
+
+CONFIG = """
+[environment]
+SQLITE_DATABASE_FILE = "{dbfile}"
+LOG_LEVEL = "WARNING"
+[flask]
+SECRET_KEY = "benchmark"
+[gitlab]
+ENDPOINT = "{endpoint}"
+TOKEN = "benchmark"
+GROUP = {group}
+BASEURL = "{endpoint}/"
+"""
+
+
+def make_app(workdir, server = None, **gitlab):
+  workdir = Path(workdir)
+  config = workdir / 'gsm_config.toml'
+  endpoint = server.url if server else 'http://127.0.0.1:9'
+  config.write_text(CONFIG.format(dbfile = workdir / 'gsm.sqlite', endpoint = endpoint, group = GROUP_ID) + ''.join(f'{k} = {v!r}\n' for k, v in gitlab.items()))
+  exercises = workdir / 'exercises'
+  exercises.mkdir(exist_ok = True)
+  if server:
+    for name in server.course.exercise_names(): (exercises / name).mkdir(exist_ok = True)
+  environ['GSM_CONFIG_FILE'] = str(config)
+  environ.pop('GSM_SQLITE_DATABASE_FILE', None)
+  from gsm import create_app
+  app = create_app()
+  app.config['BENCHMARK_EXERCISES'] = str(exercises)
+  return app
+
+
+def timed_get(client, url, repeat = 3):
+  best = None
+  for _ in range(repeat):
+    start = perf_counter()
+    response = client.get(url)
+    elapsed = perf_counter() - start
+    if response.status_code != 200: raise RuntimeError(f'GET {url} returned {response.status_code}')
+    best = elapsed if best is None else min(best, elapsed)
+  return best
+
+
+def invoke(app, command, *args):
+  result = app.test_cli_runner().invoke(command, list(args))
+  if result.exception: raise result.exception
+  return result.output
@@ -0,0 +1,308 @@
+"""A fake GitLab API serving a synthetic course, for benchmarking gsm.cli.
+
+The course is generated deterministically from its size, so nothing is kept in
+memory: every student is a subgroup of GROUP_ID containing one project per
+exercise, every project has a number of pipelines, every pipeline a number of
+jobs. Every tenth pipeline is run by the teacher (and hence discarded) and
+every fourth one is still running (and hence not accepted).
+"""
+
+import json
+from hashlib import md5
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from random import Random
+from threading import Thread
+from time import sleep
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+GROUP_ID = 1
+STUDENT_BASE = 1000
+PROJECT_BASE = 100000
+CREATED_AT = '2023-09-01T10:00:00.000Z'
+STATUSES = ['success', 'failed', 'canceled', 'running']
+
+
+class Course:
+
+  def __init__(self, students = 10, exercises = 5, pipelines = 3, jobs = 2):
+    self.students = students
+    self.exercises = exercises
+    self.pipelines = pipelines
+    self.jobs = jobs
+
+  def exercise_names(self):
+    return [f'ex{j:02d}' for j in range(self.exercises)]
+
+  def student(self, i):
+    return {'id': STUDENT_BASE + i, 'name': f'student{i:04d}', 'full_path': f'course/student{i:04d}', 'created_at': CREATED_AT}
+
+  def student_index(self, id):
+    i = id - STUDENT_BASE
+    return i if 0 <= i < self.students else None
+
+  def project(self, id):
+    i, j = divmod(id - PROJECT_BASE, self.exercises)
+    if not 0 <= i < self.students: return None
+    return {
+      'id': id,
+      'name': f'ex{j:02d}',
+      'created_at': CREATED_AT,
+      'last_activity_at': CREATED_AT,
+      'namespace': {'id': STUDENT_BASE + i, 'full_path': f'course/student{i:04d}'}
+    }
+
+  def projects(self, i):
+    return [self.project(PROJECT_BASE + i * self.exercises + j) for j in range(self.exercises)]
+
+  def pipeline_ids(self, project_id):
+    return [project_id * 100 + k for k in range(self.pipelines)]
+
+  def pipeline(self, id):
+    project = self.project(id // 100)
+    if project is None or id % 100 >= self.pipelines: return None
+    username = 'teacher' if id % 10 == 9 else project['namespace']['full_path'].split('/')[-1]
+    return {
+      'id': id,
+      'project_id': project['id'],
+      'status': STATUSES[id % len(STATUSES)],
+      'sha': f'{id:040x}',
+      'created_at': CREATED_AT,
+      'updated_at': CREATED_AT,
+      'user': {'username': username}
+    }
+
+  def test_report_summary(self, id):
+    count = 10
+    success = id % (count + 1)
+    return {'total': {'time': 1.0, 'count': count, 'success': success, 'failed': count - success, 'skipped': 0, 'error': 0}, 'test_suites': []}
+
+  def jobs_of(self, id):
+    pipeline = self.pipeline(id)
+    return [{
+      'id': id * 10 + l,
+      'name': f'job{l}',
+      'status': pipeline['status'],
+      'duration': 12.5,
+      'runner': {'description': 'runner'},
+      'user': pipeline['user']
+    } for l in range(self.jobs)]
+
+  def pipeline_event(self, id):
+    pipeline = self.pipeline(id)
+    return {
+      'object_kind': 'pipeline',
+      'object_attributes': {'id': id, 'status': pipeline['status'], 'sha': pipeline['sha'], 'created_at': '2023-09-01 10:00:00 UTC'},
+      'user': pipeline['user'],
+      'project': {'id': pipeline['project_id']},
+      'builds': [{'id': job['id'], 'name': job['name'], 'status': job['status']} for job in self.jobs_of(id)]
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+
+  protocol_version = 'HTTP/1.1'
+  disable_nagle_algorithm = True
+  ROUTES = [
+    (r'/groups/(\d+)', 'group'),
+    (r'/groups/(\d+)/subgroups', 'subgroups'),
+    (r'/groups/(\d+)/projects', 'group_projects'),
+    (r'/projects/(\d+)', 'project'),
+    (r'/projects/(\d+)/pipelines', 'pipelines'),
+    (r'/projects/(\d+)/pipelines/(\d+)', 'pipeline'),
+    (r'/projects/(\d+)/pipelines/(\d+)/test_report_summary', 'test_report_summary'),
+    (r'/projects/(\d+)/pipelines/(\d+)/jobs', 'jobs'),
+  ]
+
+  def log_message(self, format, *args):
+    pass
+
+  def do_GET(self):
+    self.server.requests += 1
+    if self.server.latency: sleep(self.server.latency)
+    if self.server.failure_rate and self.server.random.random() < self.server.failure_rate:
+      self.server.failures += 1
+      return self.send_json({'message': '503 Service Unavailable'}, 503)
+    url = urlsplit(self.path)
+    self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+    path = url.path.removeprefix('/api/v4')
+    for pattern, name in self.ROUTES:
+      match = re.fullmatch(pattern, path)
+      if match:
+        result = getattr(self, name)(*map(int, match.groups()))
+        break
+    else:
+      result = None
+    if result is None: return self.send_json({'message': '404 Not found'}, 404)
+    if isinstance(result, list): return self.send_page(url.path, result)
+    self.send_json(result)
+
+  def do_POST(self):
+    self.server.requests += 1
+    if self.server.latency: sleep(self.server.latency)
+    body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+    if self.server.failure_rate and self.server.random.random() < self.server.failure_rate:
+      self.server.failures += 1
+      return self.send_json({'message': '503 Service Unavailable'}, 503)
+    if urlsplit(self.path).path != '/api/graphql': return self.send_json({'message': '404 Not found'}, 404)
+    query, variables = body.get('query', ''), body.get('variables') or {}
+    if 'query GroupProjects' in query:
+      data = {'group': self.graphql_group(variables)}
+    elif 'query ProjectPipelines' in query:
+      _, student, exercise = variables['project'].split('/')
+      project = PROJECT_BASE + int(student.removeprefix('student')) * self.server.course.exercises + int(exercise.removeprefix('ex'))
+      data = {'project': {'pipelines': self.graphql_pipelines(project, variables)}}
+    else:
+      return self.send_json({'errors': [{'message': 'Unknown query'}]})
+    self.send_json({'data': data})
+
+  def graphql_page(self, items, after, first):
+    start = int(after or 0)
+    return {'pageInfo': {'hasNextPage': start + first < len(items), 'endCursor': str(start + first)}, 'nodes': items[start:start + first]}
+
+  def graphql_group(self, variables):
+    course = self.server.course
+    if variables['group'] != 'course': return None
+    projects = self.graphql_page([p for i in range(course.students) for p in course.projects(i)], variables.get('after'), variables['projects'])
+    projects['nodes'] = [{
+      'id': f'gid://gitlab/Project/{p["id"]}',
+      'name': p['name'],
+      'fullPath': f'{p["namespace"]["full_path"]}/{p["name"]}',
+      'archived': False,
+      'createdAt': p['created_at'],
+      'lastActivityAt': p['last_activity_at'],
+      'namespace': {'id': f'gid://gitlab/Group/{p["namespace"]["id"]}'},
+      'pipelines': self.graphql_pipelines(p['id'], variables | {'after': None})
+    } for p in projects['nodes']]
+    return {'projects': projects}
+
+  def graphql_pipelines(self, project_id, variables):
+    course = self.server.course
+    pipelines = [course.pipeline(p) for p in reversed(course.pipeline_ids(project_id))]
+    if variables.get('updatedAfter'): pipelines = [p for p in pipelines if p['updated_at'] > variables['updatedAfter']]
+    page = self.graphql_page(pipelines, variables.get('after'), variables['pipelines'])
+    page['nodes'] = [{
+      'id': f'gid://gitlab/Ci::Pipeline/{p["id"]}',
+      'status': p['status'].upper(),
+      'sha': p['sha'],
+      'createdAt': p['created_at'],
+      'updatedAt': p['updated_at'],
+      'user': p['user'],
+      'testReportSummary': {'total': course.test_report_summary(p['id'])['total']},
+      'jobs': {'nodes': [{
+        'id': f'gid://gitlab/Ci::Build/{j["id"]}',
+        'name': j['name'],
+        'status': j['status'].upper(),
+        'duration': j['duration'],
+        'runner': j['runner'],
+        'user': j['user']
+      } for j in course.jobs_of(p['id'])]}
+    } for p in page['nodes']]
+    return page
+
+  def send_json(self, data, status = 200, headers = {}):
+    body = json.dumps(data).encode()
+    etag = f'W/"{md5(body).hexdigest()}"'
+    if status == 200 and self.headers.get('If-None-Match') == etag:
+      self.server.not_modified += 1
+      status, body = 304, b''
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    if status in (200, 304): self.send_header('ETag', etag)
+    for key, value in headers.items(): self.send_header(key, value)
+    self.end_headers()
+    self.wfile.write(body)
+
+  def send_page(self, path, items):
+    page, per_page = int(self.query.get('page', 1)), int(self.query.get('per_page', 20))
+    pages = max(1, -(-len(items) // per_page))
+    headers = {'X-Page': str(page), 'X-Per-Page': str(per_page), 'X-Total': str(len(items)), 'X-Total-Pages': str(pages)}
+    if page < pages:
+      query = self.query | {'page': page + 1, 'per_page': per_page}
+      headers['X-Next-Page'] = str(page + 1)
+      headers['Link'] = f'<http://{self.headers["Host"]}{path}?{urlencode(query)}>; rel="next"'
+    self.send_json(items[(page - 1) * per_page:page * per_page], headers = headers)
+
+  def group(self, id):
+    course = self.server.course
+    if id == GROUP_ID: return {'id': GROUP_ID, 'name': 'course', 'full_path': 'course'}
+    i = course.student_index(id)
+    return None if i is None else course.student(i)
+
+  def subgroups(self, id):
+    if id != GROUP_ID: return []
+    return [self.server.course.student(i) for i in range(self.server.course.students)]
+
+  def group_projects(self, id):
+    course = self.server.course
+    if id == GROUP_ID:
+      if self.query.get('include_subgroups') != 'true': return []
+      return [p for i in range(course.students) for p in course.projects(i)]
+    i = course.student_index(id)
+    return None if i is None else course.projects(i)
+
+  def project(self, id):
+    return self.server.course.project(id)
+
+  def pipelines(self, id):
+    course = self.server.course
+    if course.project(id) is None: return None
+    pipelines = [course.pipeline(p) for p in reversed(course.pipeline_ids(id))]
+    if 'updated_after' in self.query:
+      pipelines = [p for p in pipelines if p['updated_at'] > self.query['updated_after']]
+    return [{k: p[k] for k in ('id', 'project_id', 'status', 'sha', 'created_at', 'updated_at')} for p in pipelines]
+
+  def pipeline(self, project_id, id):
+    pipeline = self.server.course.pipeline(id)
+    return pipeline if pipeline and pipeline['project_id'] == project_id else None
+
+  def test_report_summary(self, project_id, id):
+    if self.pipeline(project_id, id) is None: return None
+    return self.server.course.test_report_summary(id)
+
+  def jobs(self, project_id, id):
+    if self.pipeline(project_id, id) is None: return None
+    return self.server.course.jobs_of(id)
+
+
+class FakeGitLab(ThreadingHTTPServer):
+
+  daemon_threads = True
+
+  def __init__(self, course, latency = 0.0, address = ('127.0.0.1', 0), failure_rate = 0.0):
+    super().__init__(address, Handler)
+    self.course = course
+    self.latency = latency
+    self.failure_rate = failure_rate
+    self.random = Random(0)
+    self.requests = self.not_modified = self.failures = 0
+
+  @property
+  def url(self):
+    return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+  def __enter__(self):
+    Thread(target = self.serve_forever, daemon = True).start()
+    return self
+
+  def __exit__(self, *args):
+    self.shutdown()
+    self.server_close()
+
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description = 'Serve a synthetic course via a fake GitLab API.')
+  parser.add_argument('--port', type = int, default = 8080)
+  parser.add_argument('--students', type = int, default = 10)
+  parser.add_argument('--exercises', type = int, default = 5)
+  parser.add_argument('--pipelines', type = int, default = 3)
+  parser.add_argument('--jobs', type = int, default = 2)
+  parser.add_argument('--latency', type = float, default = 0.0)
+  parser.add_argument('--failure-rate', type = float, default = 0.0, help = 'Fraction of requests answered with a 503.')
+  args = parser.parse_args()
+  course = Course(args.students, args.exercises, args.pipelines, args.jobs)
+  server = FakeGitLab(course, args.latency, ('127.0.0.1', args.port), args.failure_rate)
+  print(f'Serving group {GROUP_ID} at {server.url}')
+  server.serve_forever()
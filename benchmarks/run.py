@@ -0,0 +1,153 @@
+"""Time every update_* command and admin page, emitting the results as JSON.
+
+The commands run against the fake GitLab (first on an empty database, then
+again to measure incremental runs, and finally as a single sync), the pages
+are rendered via the Flask test client on a database filled by the synthetic
+course generator, with the page cache disabled. Run from the repository root
+as::
+
+  python -m benchmarks.run --students 50 --latency 0.01 --output before.json
+  python -m benchmarks.run --students 50 --latency 0.01 --compare before.json
+
+The second run prints, for every measure, the ratio to the one in the given
+file and exits with status 1 if some of them got slower than --threshold.
+"""
+
+import argparse
+import json
+import platform
+import sys
+from datetime import datetime, timezone
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from sqlalchemy import event
+
+from benchmarks.common import invoke, make_app
+from benchmarks.fake_gitlab import PROJECT_BASE, STUDENT_BASE, Course, FakeGitLab
+from benchmarks.synthetic import generate
+
+COMMANDS = [
+  ('update_students', 'update_students'),
+  ('update_exercises', 'update_exercises'),
+  ('update_solutions', 'update_solutions'),
+  ('update_pipelines', 'update_pipelines'),
+  ('update_jobs', 'update_jobs'),
+  ('update_solutions (incremental)', 'update_solutions'),
+  ('update_pipelines (incremental)', 'update_pipelines'),
+  ('update_jobs (incremental)', 'update_jobs'),
+]
+
+PAGES = [
+  '/student/', '/exercise/', '/solution/', '/pipeline/', '/allstudent/', '/allsolution/', '/job/',
+  f'/student/details/?id={STUDENT_BASE}', f'/allstudent/details/?id={STUDENT_BASE}',
+  f'/solution/details/?id={PROJECT_BASE}', f'/allsolution/details/?id={PROJECT_BASE}',
+  f'/pipeline/details/?id={PROJECT_BASE * 100}',
+]
+
+
+def run_command(app, server, command, *args):
+  requests = server.requests
+  start = perf_counter()
+  invoke(app, command, *args)
+  return {'seconds': perf_counter() - start, 'requests': server.requests - requests}
+
+
+def bench_commands(course, latency, workers):
+  from gsm import cli
+  results = {}
+  with FakeGitLab(course, latency) as server:
+    with TemporaryDirectory() as workdir:
+      app = make_app(workdir, server, CONCURRENCY = workers)
+      with app.app_context():
+        invoke(app, cli.init_db)
+        for name, command in COMMANDS:
+          args = [app.config['BENCHMARK_EXERCISES']] if command == 'update_exercises' else []
+          results[name] = run_command(app, server, getattr(cli, command), *args)
+    with TemporaryDirectory() as workdir:
+      app = make_app(workdir, server, CONCURRENCY = workers)
+      with app.app_context():
+        invoke(app, cli.init_db)
+        results['sync'] = run_command(app, server, cli.sync, '--exercises', app.config['BENCHMARK_EXERCISES'])
+        results['sync (incremental)'] = run_command(app, server, cli.sync)
+  return results
+
+
+def bench_pages(course, repeat):
+  from gsm.models import db
+  results = {}
+  with TemporaryDirectory() as workdir:
+    app = make_app(workdir)
+    app.extensions['gsm_page_cache'].size = 0
+    client = app.test_client()
+    with app.app_context():
+      db.create_all()
+      generate(course)
+      engine = db.engine
+    queries = [0]
+    event.listen(engine, 'before_cursor_execute', lambda *args: queries.__setitem__(0, queries[0] + 1))
+    for page in PAGES:
+      best = None
+      for _ in range(repeat):
+        queries[0] = 0
+        start = perf_counter()
+        response = client.get(page)
+        elapsed = perf_counter() - start
+        if response.status_code != 200: raise RuntimeError(f'GET {page} returned {response.status_code}')
+        best = elapsed if best is None else min(best, elapsed)
+      results[page] = {'seconds': best, 'queries': queries[0], 'bytes': len(response.data)}
+  return results
+
+
+def compare(results, baseline, threshold):
+  regressions = 0
+  print(f'{"measure":52s} {"baseline":>10s} {"current":>10s} {"ratio":>7s}')
+  for section in ('commands', 'pages'):
+    for name, current in results[section].items():
+      previous = baseline.get(section, {}).get(name)
+      if previous is None: continue
+      ratio = current['seconds'] / previous['seconds'] if previous['seconds'] else float('inf')
+      slower = ratio > threshold
+      regressions += slower
+      print(f'{section + " " + name:52s} {previous["seconds"] * 1000:8.1f}ms {current["seconds"] * 1000:8.1f}ms {ratio:6.2f}x{" SLOWER" if slower else ""}')
+  return regressions
+
+
+def main():
+  parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+  parser.add_argument('--students', type = int, default = 20)
+  parser.add_argument('--exercises', type = int, default = 5)
+  parser.add_argument('--pipelines', type = int, default = 4)
+  parser.add_argument('--jobs', type = int, default = 2)
+  parser.add_argument('--latency', type = float, default = 0.0, help = 'Seconds the fake GitLab waits before every answer.')
+  parser.add_argument('--workers', type = int, default = 4)
+  parser.add_argument('--repeat', type = int, default = 3, help = 'Times every page is rendered (the best time is kept).')
+  parser.add_argument('--only', choices = ['commands', 'pages'])
+  parser.add_argument('--output', help = 'File where the JSON results are written (defaults to the standard output).')
+  parser.add_argument('--compare', metavar = 'BASELINE', help = 'JSON results of a previous run to compare with.')
+  parser.add_argument('--threshold', type = float, default = 1.25, help = 'Ratio to the baseline above which a measure is reported as slower.')
+  args = parser.parse_args()
+
+  from gsm import __version__
+  course = Course(args.students, args.exercises, args.pipelines, args.jobs)
+  results = {
+    'gsm': __version__,
+    'python': platform.python_version(),
+    'date': datetime.now(timezone.utc).isoformat(timespec = 'seconds'),
+    'course': vars(course),
+    'latency': args.latency,
+    'workers': args.workers,
+    'commands': {} if args.only == 'pages' else bench_commands(course, args.latency, args.workers),
+    'pages': {} if args.only == 'commands' else bench_pages(course, args.repeat),
+  }
+  if args.output:
+    with open(args.output, 'w') as outf: json.dump(results, outf, indent = 2)
+  elif not args.compare:
+    json.dump(results, sys.stdout, indent = 2)
+  if args.compare:
+    with open(args.compare) as inf: baseline = json.load(inf)
+    if compare(results, baseline, args.threshold): sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,70 @@
+"""Generate a synthetic course directly into the database of a gsm app.
+
+Students, exercises, solutions, pipelines and jobs are bulk inserted with
+the same id scheme used by benchmarks.fake_gitlab, so a generated database
+is consistent with the fake GitLab serving a course of the same size.
+"""
+
+from datetime import datetime, timedelta
+
+from benchmarks.fake_gitlab import PROJECT_BASE, STATUSES, STUDENT_BASE, Course
+
+START = datetime(2023, 9, 1, 10)
+BATCH = 50_000
+
+
+def rows(course):
+  for i in range(course.students):
+    yield 'student', dict(id = STUDENT_BASE + i, name = f'student{i:04d}', created_at = START)
+  for j, name in enumerate(course.exercise_names()):
+    yield 'exercise', dict(id = j + 1, name = name)
+  for i in range(course.students):
+    for j in range(course.exercises):
+      solution_id = PROJECT_BASE + i * course.exercises + j
+      created_at = START + timedelta(days = j, minutes = i)
+      yield 'solution', dict(id = solution_id, exercise_id = j + 1, student_id = STUDENT_BASE + i, created_at = created_at, last_activity_at = created_at + timedelta(hours = course.pipelines))
+      for k in range(course.pipelines):
+        pipeline_id = solution_id * 100 + k
+        status = STATUSES[k % 3]
+        yield 'pipeline', dict(
+          id = pipeline_id, solution_id = solution_id, status = status, created_at = created_at + timedelta(hours = k), sha = f'{pipeline_id:040x}',
+          summary_count = 10, summary_success = k % 11, summary_failed = 10 - k % 11, summary_skipped = 0, summary_error = 0, jobs_complete = True
+        )
+        for l in range(course.jobs):
+          yield 'job', dict(id = pipeline_id * 10 + l, pipeline_id = pipeline_id, status = status, name = f'job{l}', runner = 'runner', duration = 12)
+
+
+def generate(course):
+  """Fill the (empty) database of the current app with the given course."""
+  from gsm.models import Exercise, Job, Pipeline, Solution, Student, db, refresh_solutions
+  tables = {'student': Student, 'exercise': Exercise, 'solution': Solution, 'pipeline': Pipeline, 'job': Job}
+  batch, kind = [], None
+  for table, row in rows(course):
+    if table != kind or len(batch) == BATCH:
+      if batch: db.session.execute(db.insert(tables[kind]), batch)
+      batch, kind = [], table
+    batch.append(row)
+  if batch: db.session.execute(db.insert(tables[kind]), batch)
+  refresh_solutions(db.session)
+  db.session.commit()
+
+
+if __name__ == '__main__':
+  import argparse
+  from tempfile import mkdtemp
+  from benchmarks.common import make_app
+  parser = argparse.ArgumentParser(description = 'Generate a synthetic course database.')
+  parser.add_argument('--students', type = int, default = 100)
+  parser.add_argument('--exercises', type = int, default = 10)
+  parser.add_argument('--pipelines', type = int, default = 10)
+  parser.add_argument('--jobs', type = int, default = 2)
+  parser.add_argument('--workdir', help = 'Directory where gsm.sqlite is created (defaults to a new temporary one).')
+  args = parser.parse_args()
+  workdir = args.workdir or mkdtemp()
+  app = make_app(workdir)
+  with app.app_context():
+    from gsm.models import db
+    db.drop_all()
+    db.create_all()
+    generate(Course(args.students, args.exercises, args.pipelines, args.jobs))
+  print(f'Generated {workdir}/gsm.sqlite')
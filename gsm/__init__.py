@@ -1,25 +1,71 @@
+import gc
 import logging
 
 from flask import Flask
+from flask.cli import AppGroup
 
 __version__ = '0.4.6'
 
-logging.basicConfig(
-  level=logging.INFO,
-  format='%(asctime)s [%(levelname)s] (%(module)s/%(funcName)s): %(message)s',
-  force=True,
-)
 LOG = logging.getLogger('gm_log')
 
+
+class LazyCommands(AppGroup):
+  """The commands of the app, imported (with the GitLab stack they need) only when the CLI looks them up."""
+
+  def __init__(self, app):
+    super().__init__()
+    self.app = app
+
+  def load(self):
+    if self.app is None: return
+    app, self.app = self.app, None
+    from gsm.cli import init_cli
+    init_cli(app)
+
+  def get_command(self, ctx, name):
+    self.load()
+    return super().get_command(ctx, name)
+
+  def list_commands(self, ctx):
+    self.load()
+    return super().list_commands(ctx)
+
+
+def init_course(app):
+  """Sets up the database, the admin views and the endpoints of a course on the app."""
+  from gsm.models import bind_sqlite_pragmas, db
+  db.init_app(app)
+  bind_sqlite_pragmas(app)
+  from gsm.views import init_admin
+  init_admin(app)
+  from gsm.metrics import init_metrics
+  init_metrics(app)
+  from gsm.webhooks import init_webhooks
+  init_webhooks(app)
+  from gsm.analytics import init_analytics
+  init_analytics(app)
+  from gsm.export import init_export
+  init_export(app)
+
 def create_app():
+  logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] (%(module)s/%(funcName)s): %(message)s',
+    force=True,
+  )
   app = Flask(__name__)
+  app.cli = LazyCommands(app)
   from gsm.config import configure
   configure(app)
+  if app.config['COURSES']:
+    from gsm.courses import init_courses
+    init_courses(app)
+  else:
+    init_course(app)
+  from sqlalchemy.orm import configure_mappers
+  configure_mappers()
   from gsm.models import db
-  db.init_app(app)
-  from gsm.views import init_admin
-  init_admin(app)
-  from gsm.cli import init_cli
-  init_cli(app)
+  for course in app.extensions.get('gsm_courses', {None: app}).values():
+    with course.app_context(): db.engine.dispose()
+  gc.freeze()
   return app
-
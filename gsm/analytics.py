@@ -0,0 +1,79 @@
+from itertools import groupby
+from statistics import mean, median
+
+from flask import Blueprint, abort, jsonify
+
+from gsm.models import Exercise, Solution, SolutionProgress, Student, db
+
+bp = Blueprint('progress', __name__, url_prefix = '/api/progress')
+
+
+def hours(delta):
+  return round(delta.total_seconds() / 3600, 2)
+
+def isodate(obj):
+  return obj.isoformat() if obj else None
+
+def summary(values):
+  if not values: return None
+  return dict(mean = round(mean(values), 2), median = median(values), max = max(values))
+
+def exercise_stats(session, *where):
+  """Returns, for every exercise, how many students started and passed it and the time (and pipelines) they took to pass it, from the solution_progress rollup."""
+  query = db.select(Exercise.name, SolutionProgress.first_pipeline_at, SolutionProgress.first_success_at, SolutionProgress.pipelines_to_success).outerjoin(Exercise.solutions).outerjoin(SolutionProgress, SolutionProgress.solution_id == Solution.id)
+  stats = []
+  for name, rows in groupby(session.execute(query.where(*where).order_by(Exercise.name)), lambda row: row.name):
+    rows = [row for row in rows if row.first_pipeline_at]
+    passed = [row for row in rows if row.first_success_at]
+    stats.append(dict(
+      exercise = name,
+      started = len(rows),
+      passed = len(passed),
+      hours_to_success = summary([hours(row.first_success_at - row.first_pipeline_at) for row in passed]),
+      pipelines_to_success = summary([row.pipelines_to_success for row in passed])
+    ))
+  return stats
+
+def exercise_timeline(session, exercise_id):
+  """Returns, for every day some student started or passed the exercise, how many did and how many did so far."""
+  def by_day(column):
+    query = db.select(db.func.date(column).label('day'), db.func.count()).join(SolutionProgress.solution).where(Solution.exercise_id == exercise_id, column.is_not(None))
+    return dict(session.execute(query.group_by('day')).all())
+  started, passed = by_day(SolutionProgress.first_pipeline_at), by_day(SolutionProgress.first_success_at)
+  timeline, started_total, passed_total = [], 0, 0
+  for day in sorted(started.keys() | passed.keys()):
+    started_total += started.get(day, 0)
+    passed_total += passed.get(day, 0)
+    timeline.append(dict(day = day, started = started.get(day, 0), passed = passed.get(day, 0), started_total = started_total, passed_total = passed_total))
+  return timeline
+
+def student_progress(session, student_id):
+  """Returns the progress of the student on every exercise attempted."""
+  query = db.select(Exercise.name, SolutionProgress).join(SolutionProgress.solution).join(Solution.exercise).where(Solution.student_id == student_id)
+  return [dict(
+    exercise = name,
+    first_pipeline_at = isodate(progress.first_pipeline_at),
+    first_success_at = isodate(progress.first_success_at),
+    hours_to_success = hours(progress.first_success_at - progress.first_pipeline_at) if progress.first_success_at else None,
+    pipelines_to_success = progress.pipelines_to_success
+  ) for name, progress in session.execute(query.order_by(Exercise.name))]
+
+
+@bp.route('/exercises')
+def exercises():
+  return jsonify(exercise_stats(db.session))
+
+@bp.route('/exercises/<name>')
+def exercise(name):
+  exercise = db.session.scalar(db.select(Exercise).where(Exercise.name == name))
+  if exercise is None: abort(404)
+  return jsonify(exercise_stats(db.session, Exercise.id == exercise.id)[0] | dict(timeline = exercise_timeline(db.session, exercise.id)))
+
+@bp.route('/students/<name>')
+def student(name):
+  student = db.session.scalar(db.select(Student).where(Student.name == name))
+  if student is None: abort(404)
+  return jsonify(dict(student = name, exercises = student_progress(db.session, student.id)))
+
+def init_analytics(app):
+  app.register_blueprint(bp)
@@ -0,0 +1,98 @@
+import json
+import sqlite3
+from threading import Lock
+from time import time
+
+from requests import Response
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+class HTTPCache:
+  """An on-disk cache of GET responses carrying an ETag, bounded in size by LRU eviction."""
+
+  def __init__(self, path, max_size):
+    self.max_size = max_size
+    self.lock = Lock()
+    self.connection = sqlite3.connect(path, timeout = 30, isolation_level = None, check_same_thread = False)
+    self.connection.execute('PRAGMA journal_mode = WAL')
+    self.connection.execute('CREATE TABLE IF NOT EXISTS response (url TEXT PRIMARY KEY, etag TEXT NOT NULL, status INTEGER NOT NULL, headers TEXT NOT NULL, body BLOB NOT NULL, size INTEGER NOT NULL, used_at REAL NOT NULL)')
+    self.connection.execute('CREATE INDEX IF NOT EXISTS ix_response_used_at ON response (used_at)')
+    self.size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM response').fetchone()[0]
+    self.hits = self.misses = self.evictions = self.saved = 0
+    with self.lock: self.evict()
+
+  def get(self, url):
+    with self.lock:
+      row = self.connection.execute('SELECT etag, status, headers, body FROM response WHERE url = ?', (url, )).fetchone()
+      if row: self.connection.execute('UPDATE response SET used_at = ? WHERE url = ?', (time(), url))
+    return row
+
+  def put(self, url, etag, status, headers, body):
+    headers = json.dumps({k: v for k, v in headers.items() if k.lower() not in ('content-encoding', 'content-length', 'transfer-encoding')})
+    size = len(url) + len(headers) + len(body)
+    if size > self.max_size: return
+    with self.lock:
+      previous = self.connection.execute('SELECT size FROM response WHERE url = ?', (url, )).fetchone()
+      self.connection.execute('INSERT OR REPLACE INTO response VALUES (?, ?, ?, ?, ?, ?, ?)', (url, etag, status, headers, body, size, time()))
+      self.size += size - (previous[0] if previous else 0)
+      self.evict()
+
+  def evict(self):
+    while self.size > self.max_size:
+      oldest, size = self.connection.execute('SELECT url, size FROM response ORDER BY used_at LIMIT 1').fetchone()
+      self.connection.execute('DELETE FROM response WHERE url = ?', (oldest, ))
+      self.size -= size
+      self.evictions += 1
+
+  def count(self, hit, saved = 0):
+    with self.lock:
+      if hit:
+        self.hits += 1
+        self.saved += saved
+      else:
+        self.misses += 1
+
+  def stats(self):
+    requests = self.hits + self.misses
+    ratio = self.hits / requests * 100 if requests else 0
+    entries = self.connection.execute('SELECT COUNT(*) FROM response').fetchone()[0]
+    return f'Cache: {self.hits} hits, {self.misses} misses ({ratio:.0f}% hit ratio), {self.saved} bytes not transferred, {self.evictions} evictions, {entries} entries ({self.size} of {self.max_size} bytes)'
+
+  def close(self):
+    self.connection.close()
+
+
+class CachingAdapter(HTTPAdapter):
+  """Sends If-None-Match for cached URLs and turns a 304 Not Modified into the cached response."""
+
+  def __init__(self, *args, cache = None, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.cache = cache
+
+  def send(self, request, **kwargs):
+    if self.cache is None or request.method != 'GET': return super().send(request, **kwargs)
+    cached = self.cache.get(request.url)
+    if cached: request.headers['If-None-Match'] = cached[0]
+    response = super().send(request, **kwargs)
+    if cached and response.status_code == 304:
+      self.cache.count(True, len(cached[3]))
+      return self.cached_response(request, response, *cached[1:])
+    self.cache.count(False)
+    if response.status_code == 200 and 'ETag' in response.headers:
+      self.cache.put(request.url, response.headers['ETag'], response.status_code, response.headers, response.content)
+    return response
+
+  def cached_response(self, request, not_modified, status, headers, body):
+    response = Response()
+    response.status_code = status
+    response.reason = 'OK'
+    response.headers = CaseInsensitiveDict(json.loads(headers))
+    response._content = body
+    response.encoding = not_modified.encoding
+    response.url = request.url
+    response.request = request
+    response.connection = self
+    response.elapsed = not_modified.elapsed
+    response.from_cache = True
+    return response
@@ -1,23 +1,267 @@
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from itertools import chain
 from pathlib import Path
+from signal import SIGINT, SIGTERM, signal
+from threading import Event
+from time import perf_counter, sleep
 
 import click
 from flask import current_app
 from flask.cli import with_appcontext
 from gitlab import Gitlab
-from gitlab.exceptions import GitlabError
+from requests import Session
+from sqlalchemy import inspect, text
+from sqlalchemy.dialects.sqlite import insert as upsert
+from sqlalchemy.schema import CreateColumn
 from tqdm import tqdm
 
+from gsm import LOG
+from gsm.cache import CachingAdapter, HTTPCache
+from gsm.export import available_formats, export_chunks
+from gsm.graphql import fetch_group
+from gsm.metrics import REGISTRY, course_labels, instrument_session, write_report
 from gsm.models import *
+from gsm.scheduler import PollSchedule, RequestScheduler, SchedulingAdapter, TaskQueue
+from gsm.webhooks import hooked_pipeline
 
 ACCEPTED_STATUSES = frozenset(['success', 'failed', 'canceled'])
+RUNNING_STATUSES = frozenset(['created', 'waiting_for_resource', 'preparing', 'pending', 'running'])
+SYNC_MARGIN = timedelta(minutes = 10)
+ACTIVITY_DELAY = timedelta(hours = 1)
+WEBHOOK_MAX_ATTEMPTS = 5
+LISTING_PAGE_SIZE = 100
 
 def datestr2obj(string):
   if string is None: return None
   return datetime.fromisoformat(string[0:string.index('.')])
 
+def obj2datestr(obj):
+  return obj.isoformat() + 'Z'
+
+def utcnow():
+  return datetime.now(timezone.utc).replace(tzinfo = None)
+
+class KnownIds:
+  """Tells which of the given ids are already stored in any of the columns.
+
+  The ids are looked up 500 at a time on a connection of its own, checked out
+  of the engine at every call, so that it can be used by the worker threads
+  instead of holding every id of the history in memory.
+  """
+
+  def __init__(self, engine, *columns):
+    self.engine = engine
+    self.columns = columns
+
+  def __call__(self, ids):
+    ids, known = list(ids), set()
+    if not ids: return known
+    with self.engine.connect() as connection:
+      for i in range(0, len(ids), 500):
+        for column in self.columns: known.update(connection.execute(db.select(column).where(column.in_(ids[i:i + 500]))).scalars())
+    return known
+
+class Batch:
+  """Rows fetched from GitLab waiting to be written, committed every size items.
+
+  Rows are plain dicts, so that no ORM object is kept in the session, and are
+  bulk inserted by model (parents first). Rows another process inserted
+  meanwhile (say, process-webhooks alongside sync) are skipped. Besides rows,
+  touched holds the solutions to refresh, synced the SolutionSync rows to
+  upsert and completed the pipelines whose jobs have all been fetched.
+  """
+
+  def __init__(self, size):
+    self.size = size
+    self.items = 0
+    self.rows = {model: [] for model in (Solution, DiscardedPipeline, Pipeline, Job)}
+    self.touched = set()
+    self.synced = []
+    self.completed = []
+
+  def add(self, model, rows):
+    self.rows[model].extend(rows)
+
+  def done(self, dbs):
+    self.items += 1
+    if self.items % self.size == 0: self.commit(dbs)
+
+  def commit(self, dbs):
+    for model, rows in self.rows.items():
+      if rows: dbs.execute(upsert(model).on_conflict_do_nothing(), rows)
+      rows.clear()
+    if self.completed: dbs.execute(db.update(Pipeline).where(Pipeline.id.in_(self.completed)).values(jobs_complete = True))
+    refresh_solutions(dbs, self.touched)
+    if self.synced:
+      statement = upsert(SolutionSync)
+      dbs.execute(statement.on_conflict_do_update(index_elements = ['solution_id'], set_ = {name: statement.excluded[name] for name in ('last_activity_at', 'synced_at', 'pending')}), self.synced)
+    dbs.commit()
+    self.touched.clear()
+    self.synced.clear()
+    self.completed.clear()
+
+def keyset_pages(dbs, query, column, size):
+  """Yields the rows of the query size at a time, ordered by the (unique) column.
+
+  Every page starts after the last row of the previous one instead of
+  keeping a cursor open, since batches are committed while iterating.
+  """
+  last = None
+  while True:
+    rows = dbs.execute((query if last is None else query.where(column > last)).order_by(column).limit(size)).all()
+    if not rows: return
+    yield rows
+    last = getattr(rows[-1], column.key)
+
+workers_option = click.option('--workers', type = int, help = 'Number of concurrent GitLab requests (defaults to [gitlab] CONCURRENCY).')
+cache_stats_option = click.option('--cache-stats', is_flag = True, help = 'Print HTTP cache statistics at the end.')
+
+class GitLabAdapter(CachingAdapter, SchedulingAdapter):
+  pass
+
+class GitLabClient(Gitlab):
+  """A python-gitlab client that never retries by itself, leaving retries and backoff (within the budget) to the SchedulingAdapter of its session."""
+
+  def http_request(self, *args, **kwargs):
+    return super().http_request(*args, **kwargs | dict(obey_rate_limit = False, retry_transient_errors = False, max_retries = 0))
+
+class Connections:
+  """The HTTP session (scheduling and caching the requests) the GitLab clients of a run go through."""
+
+  def __init__(self, workers):
+    config = current_app.config
+    self.cache = HTTPCache(config['GITLAB_CACHE_FILE'], config['GITLAB_CACHE_SIZE']) if config['GITLAB_CACHE_SIZE'] else None
+    self.scheduler = RequestScheduler(config['GITLAB_REQUEST_BUDGET'], config['GITLAB_MAX_RETRIES'], config['GITLAB_BACKOFF'], workers)
+    adapter = GitLabAdapter(cache = self.cache, scheduler = self.scheduler, pool_connections = workers, pool_maxsize = workers)
+    self.session = Session()
+    self.session.mount('http://', adapter)
+    self.session.mount('https://', adapter)
+    instrument_session(self.session)
+    self.failed = 0
+
+  def counters(self):
+    return dict(retries = self.scheduler.retries, throttled = self.scheduler.throttled, hits = self.cache.hits if self.cache else 0, misses = self.cache.misses if self.cache else 0)
+
+  def close(self, cache_stats = False):
+    self.session.close()
+    click.echo(f'{self.scheduler.stats()}, {self.failed} failed')
+    if self.cache:
+      if cache_stats: click.echo(self.cache.stats())
+      self.cache.close()
+
+CONNECTIONS = ContextVar('gsm_connections', default = None)
+
+@contextmanager
+def connections(workers, cache_stats = False):
+  """Shares the same Connections among the gitlab() clients opened within, for instance by the courses synced in one run."""
+  shared = Connections(workers)
+  token = CONNECTIONS.set(shared)
+  try:
+    yield shared
+  finally:
+    CONNECTIONS.reset(token)
+    shared.close(cache_stats)
+
+@contextmanager
+def gitlab(workers = 1, cache_stats = False):
+  config = current_app.config
+  with ExitStack() as stack:
+    shared = CONNECTIONS.get() or stack.enter_context(connections(workers, cache_stats))
+    before = shared.counters()
+    queue = None
+    try:
+      with ThreadPoolExecutor(max_workers = workers) as pool:
+        queue = TaskQueue(pool)
+        yield GitLabClient(url = config['GITLAB_ENDPOINT'], private_token = config['GITLAB_TOKEN'], session = shared.session, retry_transient_errors = False), queue
+    finally:
+      failed = queue.failed if queue else []
+      for label, error in failed: click.echo(f'Failed to get {label}: {error}')
+      shared.failed += len(failed)
+      after = shared.counters()
+      REGISTRY.inc('gsm_gitlab_retries_total', after['retries'] - before['retries'])
+      REGISTRY.inc('gsm_gitlab_throttled_seconds_total', after['throttled'] - before['throttled'])
+      REGISTRY.inc('gsm_gitlab_failed_total', len(failed))
+      if shared.cache:
+        REGISTRY.inc('gsm_gitlab_cache_hits_total', after['hits'] - before['hits'])
+        REGISTRY.inc('gsm_gitlab_cache_misses_total', after['misses'] - before['misses'])
+
+course_option = click.option('--course', 'courses', multiple = True, help = 'Course to run the command for (can be repeated, defaults to all of the [courses]).')
+
+def selected_courses(names):
+  """Returns the apps of the named courses (of all of them if none), or just the current app if no course is configured."""
+  apps = current_app.extensions.get('gsm_courses')
+  if not apps:
+    if names: raise click.UsageError('No [courses] are configured.')
+    return {None: current_app._get_current_object()}
+  unknown = set(names) - apps.keys()
+  if unknown: raise click.BadParameter(f'unknown courses {", ".join(sorted(unknown))}', param_hint = '--course')
+  return {name: apps[name] for name in names or apps}
+
+def for_each_course(command):
+  """Adds the --course option and runs the command in the app context of every course selected, sharing the GitLab connections among them."""
+  @course_option
+  @wraps(command)
+  def wrapper(*args, courses, **kwargs):
+    apps = selected_courses(courses)
+    if None in apps: return command(*args, **kwargs)
+    with ExitStack() as stack:
+      if 'workers' in kwargs: stack.enter_context(connections(kwargs['workers'] or current_app.config['GITLAB_CONCURRENCY'], kwargs.get('cache_stats', False)))
+      for name, app in apps.items():
+        click.echo(f'Course {name}')
+        with app.app_context(): command(*args, **kwargs)
+  return wrapper
+
+def instrumented(command):
+  """Labels the metrics collected while running the command with its name, and writes them to the run report.
+
+  Commands that keep running, or handle every course in turn, wrap each
+  round for a course in reported_round() instead, so that what is left to
+  report at the end is just what was collected outside of them (if any).
+  """
+  @wraps(command)
+  def wrapper(*args, **kwargs):
+    name = click.get_current_context().info_name
+    labels = REGISTRY.labels
+    REGISTRY.clear(command = name)
+    REGISTRY.labels = labels | {'command': name}
+    started_at, start = obj2datestr(utcnow()), perf_counter()
+    try:
+      return command(*args, **kwargs)
+    finally:
+      if any(REGISTRY.snapshot(command = name).values()):
+        seconds = perf_counter() - start
+        REGISTRY.observe('gsm_command_seconds', seconds)
+        write_report(current_app.config['METRICS_REPORT_FILE'], name, started_at, seconds)
+      REGISTRY.labels = labels
+  return wrapper
+
+@contextmanager
+def reported_round():
+  """Labels the metrics collected within with the course of the current app, and writes them to its run report (as the last run of the command) at the end.
+
+  The metrics are then cleared, so that they do not pile up for the life of
+  the process.
+  """
+  name = click.get_current_context().info_name
+  labels, course = REGISTRY.labels, course_labels()
+  REGISTRY.labels = labels | course
+  started_at, start = obj2datestr(utcnow()), perf_counter()
+  try:
+    yield
+  finally:
+    seconds = perf_counter() - start
+    REGISTRY.observe('gsm_command_seconds', seconds)
+    REGISTRY.labels = labels
+    write_report(current_app.config['METRICS_REPORT_FILE'], name, started_at, seconds, **course)
+    REGISTRY.clear(command = name, **course)
+
 @click.command()
 @with_appcontext
+@for_each_course
 def init_db():
   import gsm.models
   gsm.models.db.drop_all()
@@ -27,17 +271,90 @@ def init_db():
 
 @click.command()
 @with_appcontext
-def update_students():
+@for_each_course
+def migrate_db():
+  dbs = db.session
+  db.create_all()
+  existing = inspect(db.engine)
+  for table in db.metadata.sorted_tables:
+    columns = {column['name'] for column in existing.get_columns(table.name)}
+    for column in table.columns:
+      if column.name in columns: continue
+      dbs.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {CreateColumn(column).compile(db.engine)}'))
+      click.echo(f'Added column {table.name}.{column.name}')
+    for index in table.indexes: index.create(dbs.connection(), checkfirst = True)
+  dbs.execute(db.update(Pipeline).where(~Pipeline.jobs_complete, Pipeline.id.in_(db.select(Job.pipeline_id))).values(jobs_complete = True))
+  refresh_solutions(dbs)
+  dbs.execute(text('ANALYZE'))
+  dbs.commit()
+  click.echo('DB migrated')
+
+class Listing:
+  """A GitLab listing fetched on a TaskQueue, LISTING_PAGE_SIZE items per page.
+
+  The first page tells how many pages there are, and all the others are then
+  submitted at once to be fetched concurrently; GitLab omits such number for
+  more than 10000 items, and then the pages are followed one after the other.
+  Items are listed by ascending id, so that the ones created meanwhile are
+  appended to the last page instead of shifting the others; still, an item
+  can show up on two pages (if one before it is deleted while they are
+  fetched), hence unique() drops the ones already seen.
+  """
+
+  def __init__(self, gl, path, **filters):
+    self.gl = gl
+    self.path = path
+    self.filters = dict(order_by = 'id', sort = 'asc') | filters
+    self.seen = set()
+
+  def fetch(self, page):
+    response = self.gl.http_request('get', self.path, query_data = self.filters | dict(page = page, per_page = LISTING_PAGE_SIZE))
+    total, next = response.headers.get('X-Total-Pages'), response.headers.get('X-Next-Page')
+    if total: following = range(page + 1, int(total) + 1) if page == 1 else []
+    else: following = [int(next)] if next else []
+    return response.json(), following
+
+  def submit(self, queue, item, pages = (1, )):
+    for page in pages: queue.submit(f'{self.path} (page {page})', item, self.fetch, page)
+
+  def unique(self, items):
+    fresh = []
+    for item in items:
+      if item['id'] in self.seen: continue
+      self.seen.add(item['id'])
+      fresh.append(item)
+    return fresh
+
+def group_path(gl, group, resource):
+  return f'/groups/{gl.groups.get(group, lazy = True).encoded_id}/{resource}'
+
+def fetch_students(gl, queue, group):
+  listing = Listing(gl, group_path(gl, group, 'subgroups'))
+  listing.submit(queue, 'students')
+  students = []
+  for _, (page, following) in queue:
+    listing.submit(queue, 'students', following)
+    students.extend(dict(id = student['id'], name = student['name'], created_at = datestr2obj(student['created_at'])) for student in listing.unique(page))
+  return students
+
+@click.command()
+@workers_option
+@cache_stats_option
+@with_appcontext
+@for_each_course
+@instrumented
+def update_students(workers, cache_stats):
+  workers = workers or current_app.config['GITLAB_CONCURRENCY']
   dbs = db.session
   try:
     dbs.begin()
     known = frozenset(dbs.execute(db.select(Student.id)).scalars().all())
     added = []
-    with Gitlab(url = current_app.config['GITLAB_ENDPOINT'], private_token = current_app.config['GITLAB_TOKEN']) as gl:
-      for student in tqdm(gl.groups.get(current_app.config['GITLAB_GROUP']).subgroups.list(all = True), position = 0):
-        if student.id in known: continue
-        dbs.add(Student(id = student.id, name = student.name, created_at = datestr2obj(student.created_at)))
-        added.append(student.id)
+    with gitlab(workers, cache_stats) as (gl, queue):
+      for student in tqdm(fetch_students(gl, queue, current_app.config['GITLAB_GROUP']), position = 0):
+        if student['id'] in known: continue
+        dbs.add(Student(**student))
+        added.append(student['id'])
     dbs.commit()
     if added: print('Added:', added)
   except Exception:
@@ -47,6 +364,8 @@ def update_students():
 @click.command()
 @click.argument("path")
 @with_appcontext
+@for_each_course
+@instrumented
 def update_exercises(path):
   dbs = db.session
   try:
@@ -63,134 +382,604 @@ def update_exercises(path):
     dbs.rollback()
     raise
 
+def project2solution(project):
+  return dict(
+    id = project['id'],
+    name = project['name'],
+    created_at = datestr2obj(project['created_at']),
+    last_activity_at = datestr2obj(project['last_activity_at']),
+    student_id = project['namespace']['id']
+  )
+
+def projects_listing(gl):
+  return Listing(gl, group_path(gl, current_app.config['GITLAB_GROUP'], 'projects'), include_subgroups = 'true', archived = 'false')
+
+def classify_solutions(solutions, known, exercise2id):
+  added, updated = [], []
+  for solution in solutions:
+    if solution['id'] in known: 
+      if known[solution['id']] != solution['last_activity_at']: updated.append(dict(id = solution['id'], last_activity_at = solution['last_activity_at']))
+      continue
+    # prefix = f'{student.name}-'
+    # if not solution.name.startswith(prefix): continue
+    # exercise = solution.name[len(prefix):]
+    exercise = solution['name']
+    if not exercise in exercise2id: continue
+    added.append(dict(
+      id = solution['id'], 
+      created_at = solution['created_at'], 
+      last_activity_at = solution['last_activity_at'],
+      exercise_id = exercise2id[exercise], 
+      student_id = solution['student_id']
+    ))
+  return added, updated
+
 @click.command()
+@workers_option
+@cache_stats_option
 @with_appcontext
-def update_solutions():
+@for_each_course
+@instrumented
+def update_solutions(workers, cache_stats):
+  workers = workers or current_app.config['GITLAB_CONCURRENCY']
   dbs = db.session
   try:
     dbs.begin()
-    known = frozenset(dbs.execute(db.select(Solution.id)).scalars().all())
+    known = dict(dbs.execute(db.select(Solution.id, Solution.last_activity_at)).all())
     exercise2id = dict(dbs.execute(db.select(Exercise.name, Exercise.id)).all())
     added, updated = [], []
-    with Gitlab(url = current_app.config['GITLAB_ENDPOINT'], private_token = current_app.config['GITLAB_TOKEN']) as gl:
-      for student in tqdm(dbs.execute(db.select(Student)).scalars().all(), position = 0):
-        try:
-          solutions = gl.groups.get(student.id).projects.list(all = True, archived = False)
-        except GitlabError:
-          click.echo(f'Failed to get projects for student {student}')
-          continue
-        for solution in solutions:
-          if solution.id in known: 
-            s = dbs.query(Solution).get(solution.id)
-            la = datestr2obj(solution.last_activity_at)
-            if s.last_activity_at != la:
-              s.last_activity_at = la
-              updated.append(solution.id)
-              dbs.add(s)
-            continue
-          # prefix = f'{student.name}-'
-          # if not solution.name.startswith(prefix): continue
-          # exercise = solution.name[len(prefix):]
-          exercise = solution.name
-          if not exercise in exercise2id: continue
-          dbs.add(Solution(
-            id = solution.id, 
-            created_at = datestr2obj(solution.created_at), 
-            last_activity_at = datestr2obj(solution.last_activity_at),
-            exercise_id = exercise2id[exercise], 
-            student_id = student.id
-          ))
-          added.append(solution.id)
-        dbs.flush()
+    start = perf_counter()
+    students = frozenset(dbs.execute(db.select(Student.id)).scalars().all())
+    with gitlab(workers, cache_stats) as (gl, queue):
+      listing = projects_listing(gl)
+      listing.submit(queue, 'projects')
+      progress = tqdm(total = 1, position = 0)
+      for _, (projects, following) in queue:
+        listing.submit(queue, 'projects', following)
+        progress.total = queue.submitted
+        progress.update()
+        new, changed = classify_solutions([solution for solution in map(project2solution, listing.unique(projects)) if solution['student_id'] in students], known, exercise2id)
+        added.extend(new)
+        updated.extend(changed)
+      progress.close()
+    gitlab_time, start = perf_counter() - start, perf_counter()
+    batch_size = current_app.config['COMMIT_BATCH_SIZE']
+    for statement, rows in (db.insert(Solution), added), (db.update(Solution), updated):
+      for i in range(0, len(rows), batch_size):
+        dbs.execute(statement, rows[i:i + batch_size])
+        dbs.commit()
     dbs.commit()
-    if added or updated: print('Added:', added, 'Updated:', updated)
+    db_time = perf_counter() - start
+    if added or updated: print('Added:', [s['id'] for s in added], 'Updated:', [s['id'] for s in updated])
+    print(f'Elapsed: {gitlab_time:.2f}s GitLab, {db_time:.2f}s DB')
+  except Exception:
+    dbs.rollback()
+    raise
+
+def pipeline2row(solution_id, id, created_at, status, sha, summary):
+  return dict(
+    id = id, 
+    created_at = created_at, 
+    solution_id = solution_id, 
+    status = status, 
+    sha = sha,
+    summary_count = summary['count'],
+    summary_success = summary['success'],
+    summary_failed = summary['failed'],
+    summary_skipped = summary['skipped'],
+    summary_error = summary['error']
+  )
+
+def fetch_pipeline(project, solution_id, pipeline_id, student):
+  pipeline = project.pipelines.get(pipeline_id)
+  if pipeline.user['username'] != student: return 'discarded', pipeline.id
+  if pipeline.status in RUNNING_STATUSES: return 'pending', datestr2obj(pipeline.updated_at)
+  if pipeline.status not in ACCEPTED_STATUSES: return 'waiting', pipeline.id
+  summary = pipeline.test_report_summary.get().total
+  return 'accepted', pipeline2row(solution_id, pipeline.id, datestr2obj(pipeline.created_at), pipeline.status, pipeline.sha, summary)
+
+def fetch_pipelines(gl, solution_id, student, known, updated_after = None):
+  """Returns the pipelines updated after the given date that are discarded and accepted, and the earliest last update of those still running (or None).
+
+  Pipelines neither finished nor running (skipped, manual or scheduled ones)
+  are not recorded: they are listed again once they get updated.
+  """
+  project = gl.projects.get(solution_id, lazy = True)
+  discarded, accepted, pending = [], [], None
+  filters = {'updated_after': obj2datestr(updated_after)} if updated_after else {}
+  listed = [pipeline.id for pipeline in project.pipelines.list(all = True, per_page = LISTING_PAGE_SIZE, **filters)]
+  known = known(listed)
+  for pipeline_id in listed:
+    if pipeline_id in known: continue
+    kind, pipeline = fetch_pipeline(project, solution_id, pipeline_id, student)
+    if kind == 'discarded': discarded.append(pipeline)
+    elif kind == 'pending': pending = min(pending or pipeline, pipeline)
+    elif kind == 'accepted': accepted.append(pipeline)
+  return discarded, accepted, pending
+
+def sync_row(solution_id, last_activity_at, synced_at, pending):
+  """Returns the SolutionSync row of a solution synced at synced_at, with pending the earliest last update of its running pipelines (or None).
+
+  While some pipeline is running the watermark stays before its last update,
+  so that it is listed again until finished even if it does not change.
+  """
+  if pending: synced_at = min(synced_at, pending - SYNC_MARGIN)
+  return dict(solution_id = solution_id, last_activity_at = last_activity_at, synced_at = synced_at, pending = pending is not None)
+
+def avoided_calls(dbs, skipped):
+  """Records (and returns) how many requests not listing the pipelines of the skipped solutions saved: a page per solution, plus one per LISTING_PAGE_SIZE pipelines stored since its last sync."""
+  if not skipped: return 0
+  since = dict(dbs.execute(db.select(Pipeline.solution_id, db.func.count()).join(SolutionSync, SolutionSync.solution_id == Pipeline.solution_id).where(Pipeline.created_at > SolutionSync.synced_at).group_by(Pipeline.solution_id)).all())
+  calls = sum(max(1, -(-since.get(id, 0) // LISTING_PAGE_SIZE)) for id in skipped)
+  REGISTRY.inc('gsm_api_calls_avoided_total', calls)
+  return calls
+
+def unchanged(sync, last_activity_at, stale):
+  """Tells if a solution needs no sync: it had no running pipeline, its last activity did not change and it was synced after stale.
+
+  GitLab refreshes the last activity of a project at most once an hour, hence
+  a solution synced within ACTIVITY_DELAY of its last activity can have
+  changed meanwhile and is synced again.
+  """
+  if sync is None or sync.pending or sync.last_activity_at != last_activity_at: return False
+  return sync.synced_at - sync.last_activity_at > ACTIVITY_DELAY and sync.synced_at > stale
+
+@click.command()
+@workers_option
+@click.option('--full', is_flag = True, help = 'Ignore sync watermarks and list all pipelines of every solution.')
+@cache_stats_option
+@with_appcontext
+@for_each_course
+@instrumented
+def update_pipelines(workers, full, cache_stats):
+  workers = workers or current_app.config['GITLAB_CONCURRENCY']
+  dbs = db.session
+  try:
+    dbs.begin()
+    known = KnownIds(db.engine, Pipeline.id, DiscardedPipeline.id)
+    syncs = {} if full else {row.solution_id: row for row in dbs.execute(SolutionSync.__table__.select())}
+    stale = utcnow() - timedelta(seconds = current_app.config['GITLAB_SYNC_MAX_AGE'])
+    solutions, skipped = [], []
+    for solution in dbs.execute(db.select(Solution.id, Solution.last_activity_at, Student.name.label('student'), Exercise.name.label('exercise')).join(Solution.student).join(Solution.exercise)):
+      sync = syncs.get(solution.id)
+      if unchanged(sync, solution.last_activity_at, stale):
+        skipped.append(solution.id)
+        continue
+      solutions.append((solution, sync.synced_at if sync else None))
+    synced_at = utcnow() - SYNC_MARGIN
+    batch = Batch(current_app.config['COMMIT_BATCH_SIZE'])
+    added = 0
+    start = perf_counter()
+    with gitlab(workers, cache_stats) as (gl, queue):
+      for solution, updated_after in solutions:
+        queue.submit(f'pipelines for solution {solution.exercise}@{solution.last_activity_at} ({solution.student})', solution, fetch_pipelines, gl, solution.id, solution.student, known, updated_after)
+      for solution, (discarded, accepted, pending) in tqdm(queue, total = len(solutions), position = 0):
+        batch.add(DiscardedPipeline, (dict(id = id) for id in discarded))
+        batch.add(Pipeline, accepted)
+        batch.synced.append(sync_row(solution.id, solution.last_activity_at, synced_at, pending))
+        added += len(accepted)
+        if accepted: batch.touched.add(solution.id)
+        batch.done(dbs)
+    avoided = avoided_calls(dbs, skipped)
+    batch.commit(dbs)
+    if added: print(f'Added: {added} pipelines')
+    if skipped: print(f'Skipped: {len(skipped)} unchanged solutions ({avoided} API calls avoided)')
+    print(f'Elapsed: {perf_counter() - start:.2f}s ({workers} workers)')
   except Exception:
     dbs.rollback()
     raise
 
+def fetch_jobs(gl, solution_id, pipeline_id, student, known = None):
+  jobs = gl.projects.get(solution_id, lazy = True).pipelines.get(pipeline_id, lazy = True).jobs.list(all = True)
+  known = known([job.id for job in jobs]) if known else ()
+  return [dict(
+    id = job.id, 
+    pipeline_id = pipeline_id, 
+    status = job.status, 
+    name = job.name,
+    duration = job.duration,
+    runner = job.runner['description'] if job.runner else None
+  ) for job in jobs if job.id not in known and job.user['username'] == student]
+
 @click.command()
+@workers_option
+@click.option('--full', is_flag = True, help = 'Fetch again the jobs of every pipeline, not only of those whose jobs were never fetched.')
+@cache_stats_option
 @with_appcontext
-def update_pipelines():
+@for_each_course
+@instrumented
+def update_jobs(workers, full, cache_stats):
+  workers = workers or current_app.config['GITLAB_CONCURRENCY']
   dbs = db.session
   try:
     dbs.begin()
-    known = frozenset(dbs.execute(db.select(Pipeline.id)).scalars().all()) | frozenset(dbs.execute(db.select(DiscardedPipeline.id)).scalars().all())
-    added = []
-    with Gitlab(url = current_app.config['GITLAB_ENDPOINT'], private_token = current_app.config['GITLAB_TOKEN']) as gl:
-      for solution in tqdm(dbs.execute(db.select(Solution)).scalars().all(), position = 0):
-        project = gl.projects.get(solution.id)
-        try:
-          pipelines = project.pipelines.list(all = True)
-        except GitlabError:
-          click.echo(f'Failed to get pipelines for solution {solution}')
-          continue
-        for pipeline in pipelines:
-          if pipeline.id in known: continue
-          pipeline = project.pipelines.get(pipeline.id)
-          if pipeline.user['username'] != solution.student.name:
-            dbs.add(DiscardedPipeline(id = pipeline.id))
+    known = KnownIds(db.engine, Job.id)
+    batch = Batch(current_app.config['COMMIT_BATCH_SIZE'])
+    query = db.select(Pipeline.id, Pipeline.solution_id, Student.name.label('student')).join(Pipeline.solution).join(Solution.student)
+    if not full: query = query.where(~Pipeline.jobs_complete)
+    added = 0
+    with gitlab(workers, cache_stats) as (gl, queue):
+      progress = tqdm(total = dbs.execute(db.select(db.func.count()).select_from(query.subquery())).scalar(), position = 0)
+      for pipelines in keyset_pages(dbs, query, Pipeline.id, batch.size):
+        for pipeline in pipelines: queue.submit(f'jobs for pipeline {pipeline.id}', pipeline, fetch_jobs, gl, pipeline.solution_id, pipeline.id, pipeline.student, known)
+        for pipeline, jobs in queue:
+          batch.add(Job, jobs)
+          batch.completed.append(pipeline.id)
+          added += len(jobs)
+          progress.update()
+        batch.commit(dbs)
+      progress.close()
+    batch.commit(dbs)
+    if added: print(f'Added: {added} jobs')
+  except Exception:
+    dbs.rollback()
+    raise
+
+def fetch_hooked_pipeline(gl, solution_id, pipeline_id, student):
+  kind, pipeline = fetch_pipeline(gl.projects.get(solution_id, lazy = True), solution_id, pipeline_id, student)
+  return kind, pipeline, fetch_jobs(gl, solution_id, pipeline_id, student) if kind == 'accepted' else []
+
+def process_webhook_events(dbs, workers):
+  try:
+    dbs.begin()
+    events = dbs.execute(db.select(WebhookEvent).order_by(WebhookEvent.id).limit(current_app.config['COMMIT_BATCH_SIZE'])).scalars().all()
+    if not events:
+      dbs.commit()
+      return 0
+    pipelines, done = {}, []
+    for event in events:
+      if event.event != 'Pipeline Hook':
+        done.append(event.id)
+        continue
+      try:
+        pipelines[event.id] = hooked_pipeline(event.payload)
+      except (KeyError, TypeError):
+        LOG.warning('Malformed payload of event %d', event.id)
+    solutions = dict(dbs.execute(db.select(Solution.id, Student.name).join(Solution.student).where(Solution.id.in_({solution_id for _, solution_id, _, _ in pipelines.values()}))).all())
+    pipeline_ids = {id for id, _, _, _ in pipelines.values()}
+    known = set(dbs.execute(db.select(Pipeline.id).where(Pipeline.id.in_(pipeline_ids))).scalars())
+    known |= set(dbs.execute(db.select(DiscardedPipeline.id).where(DiscardedPipeline.id.in_(pipeline_ids))).scalars())
+    added = dict(pipelines = 0, jobs = 0, discarded = 0)
+    batch = Batch(len(events))
+    with gitlab(workers) as (gl, queue):
+      for event_id, (id, solution_id, status, username) in pipelines.items():
+        if status in ACCEPTED_STATUSES and id not in known and solution_id in solutions:
+          known.add(id)
+          if username != solutions[solution_id]:
+            batch.add(DiscardedPipeline, [dict(id = id)])
+            added['discarded'] += 1
+          else:
+            queue.submit(f'pipeline {id} of solution {solution_id}', (event_id, solution_id), fetch_hooked_pipeline, gl, solution_id, id, solutions[solution_id])
             continue
-          if pipeline.status not in ACCEPTED_STATUSES: continue
-          summary = pipeline.test_report_summary.get().total
-          dbs.add(Pipeline(
-            id = pipeline.id, 
-            created_at = datestr2obj(pipeline.created_at), 
-            solution_id = solution.id, 
-            status = pipeline.status, 
-            sha = pipeline.sha,
-            summary_count = summary['count'],
-            summary_success = summary['success'],
-            summary_failed = summary['failed'],
-            summary_skipped = summary['skipped'],
-            summary_error = summary['error']
-          ))
-          added.append(pipeline.id)
-      dbs.flush()    
-    dbs.commit()
-    if added: print('Added:', added)
+        done.append(event_id)
+      for (event_id, solution_id), (kind, pipeline, pipeline_jobs) in queue:
+        if kind == 'discarded':
+          batch.add(DiscardedPipeline, [dict(id = pipeline)])
+          added['discarded'] += 1
+        elif kind == 'accepted':
+          batch.add(Pipeline, [pipeline | dict(jobs_complete = True)])
+          batch.add(Job, pipeline_jobs)
+          batch.touched.add(solution_id)
+          added['pipelines'] += 1
+          added['jobs'] += len(pipeline_jobs)
+        done.append(event_id)
+    dbs.execute(db.delete(WebhookEvent).where(WebhookEvent.id.in_(done)))
+    failed = [event.id for event in events if event.id not in frozenset(done)]
+    if failed:
+      dbs.execute(db.update(WebhookEvent).where(WebhookEvent.id.in_(failed)).values(attempts = WebhookEvent.attempts + 1))
+      dropped = dbs.execute(db.delete(WebhookEvent).where(WebhookEvent.id.in_(failed), WebhookEvent.attempts >= WEBHOOK_MAX_ATTEMPTS)).rowcount
+      if dropped: click.echo(f'Dropped {dropped} events failing {WEBHOOK_MAX_ATTEMPTS} times')
+    batch.commit(dbs)
+    click.echo(f'Processed {len(done)} of {len(events)} events, added: ' + ', '.join(f'{count} {kind}' for kind, count in added.items()))
+    return len(done)
   except Exception:
     dbs.rollback()
     raise
 
 @click.command()
+@workers_option
+@click.option('--watch', is_flag = True, help = 'Keep waiting for new events instead of exiting once the queue is empty.')
+@click.option('--interval', type = float, default = 5.0, help = 'Seconds between checks of the queue when watching.')
+@course_option
 @with_appcontext
-def update_jobs():
+@instrumented
+def process_webhooks(workers, watch, interval, courses):
+  workers = workers or current_app.config['GITLAB_CONCURRENCY']
+  apps = selected_courses(courses).values()
+  with connections(workers):
+    while True:
+      processed = 0
+      for app in apps:
+        with app.app_context(), reported_round(): processed += process_webhook_events(db.session, workers)
+      if not watch: break
+      if not processed: sleep(interval)
+
+def graphql_items(gl, students, solutions, exercise2id, known_pipelines, known_jobs, updated_after):
+  """Yields the projects, pipelines and jobs of the group fetched via GraphQL, as sync expects them from its queue."""
+  config = current_app.config
+  group = gl.groups.get(config['GITLAB_GROUP']).full_path
+  for project in fetch_group(gl, group, updated_after, config['GITLAB_GRAPHQL_PAGE_SIZE'], config['GITLAB_GRAPHQL_PIPELINES_PAGE_SIZE']):
+    student = students.get(project['student_id'])
+    if student is None or project['archived']: continue
+    yield ('solutions', None, None), ([{k: project[k] for k in ('id', 'name', 'created_at', 'last_activity_at', 'student_id')}], [])
+    if project['id'] not in solutions and project['name'] not in exercise2id: continue
+    discarded, accepted, jobs, pending = [], [], {}, None
+    known = known_pipelines([pipeline['id'] for pipeline in project['pipelines']])
+    known_project_jobs = known_jobs([job['id'] for pipeline in project['pipelines'] if pipeline['id'] not in known for job in pipeline['jobs']])
+    for pipeline in project['pipelines']:
+      if pipeline['id'] in known: continue
+      if pipeline['username'] != student: discarded.append(pipeline['id'])
+      elif pipeline['status'] in RUNNING_STATUSES: pending = min(pending or pipeline['updated_at'], pipeline['updated_at'])
+      elif pipeline['status'] in ACCEPTED_STATUSES:
+        accepted.append(pipeline2row(project['id'], pipeline['id'], pipeline['created_at'], pipeline['status'], pipeline['sha'], pipeline['summary']))
+        jobs[pipeline['id']] = [dict(
+          id = job['id'],
+          pipeline_id = pipeline['id'],
+          status = job['status'],
+          name = job['name'],
+          duration = job['duration'],
+          runner = job['runner']
+        ) for job in pipeline['jobs'] if job['id'] not in known_project_jobs and job['username'] == student]
+    yield ('pipelines', project['id'], (student, project['last_activity_at'])), (discarded, accepted, pending)
+    for pipeline in accepted: yield ('jobs', pipeline['id'], student), jobs[pipeline['id']]
+
+@click.command()
+@click.option('--workers', type = int, help = 'Number of concurrent GitLab requests (defaults to [gitlab] CONCURRENCY).')
+@click.option('--exercises', 'path', type = click.Path(exists = True, file_okay = False), help = 'Also add the exercises in the given directory (as update_exercises does).')
+@cache_stats_option
+@with_appcontext
+@for_each_course
+@instrumented
+def sync(workers, path, cache_stats):
+  workers = workers or current_app.config['GITLAB_CONCURRENCY']
+  if path: click.get_current_context().invoke(update_exercises, path = path)
+  graphql = current_app.config['GITLAB_BACKEND'] == 'graphql'
   dbs = db.session
-  projects = {}
   try:
     dbs.begin()
-    known = frozenset(dbs.execute(db.select(Job.id)).scalars().all())
-    added = []
-    with Gitlab(url = current_app.config['GITLAB_ENDPOINT'], private_token = current_app.config['GITLAB_TOKEN']) as gl:
-      for pipeline in tqdm(dbs.execute(db.select(Pipeline)).scalars().all(), position = 0):
-        if pipeline.solution_id not in projects: projects[pipeline.solution_id] = gl.projects.get(pipeline.solution_id)
-        try:
-          jobs = projects[pipeline.solution_id].pipelines.get(pipeline.id).jobs.list(all = True)
-        except GitlabError:
-          click.echo(f'Failed to get jobs for pipeline {pipeline}')
-          continue
-        for job in jobs:
-          if job.id in known or job.user['username'] != pipeline.solution.student.name: continue
-          dbs.add(Job(
-            id = job.id, 
-            pipeline_id = pipeline.id, 
-            status = job.status, 
-            name = job.name,
-            duration = job.duration,
-            runner = job.runner['description'] if job.runner else None
-          ))
-          added.append(job.id)
-      dbs.flush()    
-    dbs.commit()
-    if added: print('Added:', added)
+    students = dict(dbs.execute(db.select(Student.id, Student.name)).all())
+    exercise2id = dict(dbs.execute(db.select(Exercise.name, Exercise.id)).all())
+    solutions = dict(dbs.execute(db.select(Solution.id, Solution.last_activity_at)).all())
+    syncs = {row.solution_id: row for row in dbs.execute(SolutionSync.__table__.select())}
+    stale = utcnow() - timedelta(seconds = current_app.config['GITLAB_SYNC_MAX_AGE'])
+    known_pipelines = KnownIds(db.engine, Pipeline.id, DiscardedPipeline.id)
+    known_jobs = KnownIds(db.engine, Job.id)
+    incomplete = dbs.execute(db.select(Pipeline.id, Pipeline.solution_id, Student.name.label('student')).join(Pipeline.solution).join(Solution.student).where(~Pipeline.jobs_complete)).all()
+    batch = Batch(current_app.config['COMMIT_BATCH_SIZE'])
+    synced_at = utcnow() - SYNC_MARGIN
+    added = dict(students = 0, solutions = 0, pipelines = 0, jobs = 0)
+    updated = 0
+    skipped = []
+    start = perf_counter()
+    with gitlab(workers, cache_stats) as (gl, queue):
+      for student in fetch_students(gl, queue, current_app.config['GITLAB_GROUP']):
+        if student['id'] in students: continue
+        dbs.add(Student(**student))
+        students[student['id']] = student['name']
+        added['students'] += 1
+      dbs.commit()
+      if graphql:
+        updated_after = None if added['students'] or solutions.keys() - syncs.keys() else min((sync.synced_at for sync in syncs.values()), default = None)
+        items = graphql_items(gl, students, solutions, exercise2id, known_pipelines, known_jobs, updated_after)
+      else:
+        listing = projects_listing(gl)
+        listing.submit(queue, ('solutions', None, None))
+        items = ()
+      for pipeline in incomplete: queue.submit(f'jobs for pipeline {pipeline.id}', ('jobs', pipeline.id, pipeline.student), fetch_jobs, gl, pipeline.solution_id, pipeline.id, pipeline.student, known_jobs)
+      progress = tqdm(total = None if graphql else queue.submitted, position = 0)
+      for (kind, id, context), result in chain(items, queue):
+        if kind == 'solutions':
+          page, following = result
+          if following: listing.submit(queue, ('solutions', None, None), following)
+          page = [solution for solution in (page if graphql else map(project2solution, listing.unique(page))) if solution['student_id'] in students]
+          new, changed = classify_solutions(page, solutions, exercise2id)
+          batch.add(Solution, new)
+          if changed: dbs.execute(db.update(Solution), changed)
+          added['solutions'] += len(new)
+          updated += len(changed)
+          for solution in [] if graphql else page:
+            student = students[solution['student_id']]
+            if solution['id'] not in solutions and solution['name'] not in exercise2id: continue
+            previous = syncs.get(solution['id'])
+            if unchanged(previous, solution['last_activity_at'], stale):
+              skipped.append(solution['id'])
+              continue
+            queue.submit(f'pipelines for solution {solution["id"]}', ('pipelines', solution['id'], (student, solution['last_activity_at'])), fetch_pipelines, gl, solution['id'], student, known_pipelines, previous.synced_at if previous else None)
+        elif kind == 'pipelines':
+          student, last_activity_at = context
+          discarded, accepted, pending = result
+          batch.add(DiscardedPipeline, (dict(id = pipeline) for pipeline in discarded))
+          batch.add(Pipeline, accepted)
+          batch.synced.append(sync_row(id, last_activity_at, synced_at, pending))
+          added['pipelines'] += len(accepted)
+          if accepted: batch.touched.add(id)
+          for pipeline in [] if graphql else accepted: queue.submit(f'jobs for pipeline {pipeline["id"]}', ('jobs', pipeline['id'], student), fetch_jobs, gl, id, pipeline['id'], student, known_jobs)
+        else:
+          batch.add(Job, result)
+          added['jobs'] += len(result)
+          batch.completed.append(id)
+        if not graphql: progress.total = queue.submitted
+        progress.update()
+        batch.done(dbs)
+      progress.close()
+    avoided = avoided_calls(dbs, skipped)
+    batch.commit(dbs)
+    print('Added:', ', '.join(f'{count} {kind}' for kind, count in added.items()), f'(updated {updated} solutions)')
+    if skipped: print(f'Skipped: {len(skipped)} unchanged solutions ({avoided} API calls avoided)')
+    print(f'Elapsed: {perf_counter() - start:.2f}s ({workers} workers)')
   except Exception:
     dbs.rollback()
     raise
 
+def discover(dbs, gl, queue):
+  """Adds the new students and solutions and updates the last activity of the known solutions, returning how many were added and updated."""
+  students = frozenset(dbs.execute(db.select(Student.id)).scalars().all())
+  new_students = [student for student in fetch_students(gl, queue, current_app.config['GITLAB_GROUP']) if student['id'] not in students]
+  if new_students: dbs.execute(db.insert(Student), new_students)
+  students |= {student['id'] for student in new_students}
+  known = dict(dbs.execute(db.select(Solution.id, Solution.last_activity_at)).all())
+  exercise2id = dict(dbs.execute(db.select(Exercise.name, Exercise.id)).all())
+  listing = projects_listing(gl)
+  listing.submit(queue, 'projects')
+  added = updated = 0
+  for _, (projects, following) in queue:
+    listing.submit(queue, 'projects', following)
+    new, changed = classify_solutions([solution for solution in map(project2solution, listing.unique(projects)) if solution['student_id'] in students], known, exercise2id)
+    if new: dbs.execute(db.insert(Solution), new)
+    if changed: dbs.execute(db.update(Solution), changed)
+    added += len(new)
+    updated += len(changed)
+  dbs.commit()
+  return len(new_students), added, updated
+
+def schedule_solutions(dbs, schedule, solutions, now):
+  """Schedules the solutions not seen before or whose last activity changed since: right away if they changed since their last sync (or had running pipelines), else one interval after it."""
+  query = db.select(Solution.id, Solution.last_activity_at, Student.name.label('student'), SolutionSync.last_activity_at.label('synced_activity_at'), SolutionSync.synced_at, SolutionSync.pending).join(Solution.student).outerjoin(SolutionSync, SolutionSync.solution_id == Solution.id)
+  for row in dbs.execute(query):
+    previous = solutions.get(row.id)
+    if previous and previous['last_activity_at'] == row.last_activity_at: continue
+    solutions[row.id] = dict(student = row.student, last_activity_at = row.last_activity_at, synced_at = row.synced_at)
+    changed = row.synced_at is None or row.pending or row.synced_activity_at != row.last_activity_at
+    schedule.schedule(row.id, now if changed else row.synced_at + SYNC_MARGIN + schedule.interval(row.last_activity_at, now))
+  dbs.commit()
+
+def poll(dbs, gl, queue, schedule, solutions, known_pipelines, known_jobs, limit, incomplete = ()):
+  """Fetches the new pipelines (and their jobs) of the solutions due, at most limit, and schedules them again; returns how many solutions were polled and pipelines added."""
+  ids = schedule.pop_due(utcnow(), limit)
+  synced_at = utcnow() - SYNC_MARGIN
+  for id in ids: queue.submit(f'pipelines for solution {id}', ('pipelines', id), fetch_pipelines, gl, id, solutions[id]['student'], known_pipelines, solutions[id]['synced_at'])
+  for pipeline in incomplete: queue.submit(f'jobs for pipeline {pipeline.id}', ('jobs', pipeline.id), fetch_jobs, gl, pipeline.solution_id, pipeline.id, pipeline.student, known_jobs)
+  batch = Batch(current_app.config['COMMIT_BATCH_SIZE'])
+  added = 0
+  for (kind, id), result in queue:
+    if kind == 'pipelines':
+      solution = solutions[id]
+      discarded, accepted, pending = result
+      batch.add(DiscardedPipeline, (dict(id = pipeline) for pipeline in discarded))
+      batch.add(Pipeline, accepted)
+      batch.synced.append(sync_row(id, solution['last_activity_at'], synced_at, pending))
+      if accepted: batch.touched.add(id)
+      added += len(accepted)
+      solution['synced_at'] = batch.synced[-1]['synced_at']
+      schedule.schedule(id, utcnow() + schedule.interval(solution['last_activity_at'], synced_at, pending))
+      for pipeline in accepted: queue.submit(f'jobs for pipeline {pipeline["id"]}', ('jobs', pipeline['id']), fetch_jobs, gl, id, pipeline['id'], solution['student'], known_jobs)
+    else:
+      batch.add(Job, result)
+      batch.completed.append(id)
+    batch.done(dbs)
+  batch.commit(dbs)
+  for id in ids:
+    if id not in schedule.due_at: schedule.schedule(id, utcnow() + schedule.active)
+  return len(ids), added
+
+class CoursePoller:
+  """What sync-daemon knows about a course: when its solutions are due and when they were last discovered."""
+
+  def __init__(self, name, app):
+    self.name = name
+    self.app = app
+    self.discovery = timedelta(seconds = app.config['GITLAB_DISCOVERY_INTERVAL'])
+    with app.app_context():
+      self.known_pipelines = KnownIds(db.engine, Pipeline.id, DiscardedPipeline.id)
+      self.known_jobs = KnownIds(db.engine, Job.id)
+    self.failures = 0
+    self.reset()
+
+  def reset(self):
+    """Forgets the schedule, so that the next round rebuilds it from the database."""
+    config = self.app.config
+    self.schedule = PollSchedule(config['GITLAB_POLL_ACTIVE_INTERVAL'], config['GITLAB_POLL_DORMANT_INTERVAL'], config['GITLAB_POLL_ACTIVE_WINDOW'])
+    self.solutions = {}
+    self.discovered_at = None
+
+  def round(self, workers):
+    """Discovers the new solutions if due and polls the solutions due, returning when the course is due again.
+
+    If the round fails (say, GitLab is unreachable or the database locked)
+    the error is logged, the schedule is rebuilt from the database and the
+    course is due again after BACKOFF seconds, doubled at every failure in a
+    row up to POLL_ACTIVE_INTERVAL.
+    """
+    label = f'{self.name}: ' if self.name else ''
+    with self.app.app_context(), reported_round():
+      dbs = db.session
+      try:
+        with gitlab(workers) as (gl, queue):
+          incomplete = ()
+          if self.discovered_at is None or utcnow() - self.discovered_at >= self.discovery:
+            self.discovered_at = utcnow()
+            students, added, updated = discover(dbs, gl, queue)
+            schedule_solutions(dbs, self.schedule, self.solutions, self.discovered_at)
+            incomplete = dbs.execute(db.select(Pipeline.id, Pipeline.solution_id, Student.name.label('student')).join(Pipeline.solution).join(Solution.student).where(~Pipeline.jobs_complete)).all()
+            LOG.info('%sDiscovery: added %d students and %d solutions, updated %d solutions; %d solutions scheduled', label, students, added, updated, len(self.schedule))
+          polled, added = poll(dbs, gl, queue, self.schedule, self.solutions, self.known_pipelines, self.known_jobs, self.app.config['GITLAB_POLL_MAX_SOLUTIONS'] or None, incomplete)
+          if polled: LOG.info('%sPolled %d solutions, added %d pipelines', label, polled, added)
+      except Exception:
+        dbs.rollback()
+        self.failures += 1
+        delay = min(self.app.config['GITLAB_BACKOFF'] * 2 ** self.failures, self.schedule.active.total_seconds())
+        LOG.exception('%sRound failed (%d in a row), retrying in %.0fs', label, self.failures, delay)
+        self.reset()
+        return utcnow() + timedelta(seconds = delay)
+    self.failures = 0
+    return min(filter(None, (self.schedule.next_due(), self.discovered_at + self.discovery)))
+
+@click.command()
+@workers_option
+@course_option
+@with_appcontext
+@instrumented
+def sync_daemon(workers, courses):
+  """Keep syncing, polling each solution when due, until interrupted.
+
+  Solutions active within [gitlab] POLL_ACTIVE_WINDOW seconds (or with
+  running pipelines) are polled every POLL_ACTIVE_INTERVAL seconds, the
+  others every POLL_DORMANT_INTERVAL; every DISCOVERY_INTERVAL seconds new
+  students and solutions are added and the changed ones polled right away.
+  With POLL_MAX_SOLUTIONS, at most that many solutions are polled per round
+  (the others still due are polled right after).
+  With [courses], all the selected ones are polled in turn, sharing the
+  GitLab connections. Failed rounds are logged and retried after a backoff;
+  only SIGINT or SIGTERM stop the command, once the current round is
+  completed.
+  """
+  workers = workers or current_app.config['GITLAB_CONCURRENCY']
+  pollers = [CoursePoller(name, app) for name, app in selected_courses(courses).items()]
+  stop = Event()
+  handlers = {signum: signal(signum, lambda *args: stop.set()) for signum in (SIGINT, SIGTERM)}
+  try:
+    with connections(workers):
+      while not stop.is_set():
+        next_due = min(poller.round(workers) for poller in pollers)
+        stop.wait(max(0, (next_due - utcnow()).total_seconds()))
+  finally:
+    for signum, handler in handlers.items(): signal(signum, handler)
+  LOG.info('Stopped')
+
+@click.command()
+@click.option('--format', 'fmt', type = click.Choice(['csv', 'parquet']), help = 'Format of the export (defaults to the extension of OUTPUT, or csv).')
+@click.option('--course', help = 'Course to export (required if several [courses] are configured).')
+@click.argument('output', type = click.Path(dir_okay = False, allow_dash = True), default = '-')
+@with_appcontext
+def export(fmt, course, output):
+  """Write the gradebook (the latest status and test results of every student on every exercise) to OUTPUT."""
+  fmt = fmt or ('parquet' if output.endswith('.parquet') else 'csv')
+  if fmt not in available_formats(): raise click.UsageError('Exporting to Parquet requires pyarrow (pip install pyarrow).')
+  apps = selected_courses([course] if course else [])
+  if len(apps) > 1: raise click.UsageError('Choose the course to export with --course.')
+  with next(iter(apps.values())).app_context(), click.open_file(output, 'wb') as outf:
+    for chunk in export_chunks(db.session, fmt): outf.write(chunk)
+    db.session.commit()
+
 def init_cli(app):
   app.cli.add_command(init_db)
+  app.cli.add_command(migrate_db)
   app.cli.add_command(update_students)
   app.cli.add_command(update_exercises)
   app.cli.add_command(update_solutions)
   app.cli.add_command(update_pipelines)
   app.cli.add_command(update_jobs)
+  app.cli.add_command(sync)
+  app.cli.add_command(process_webhooks)
+  app.cli.add_command(sync_daemon)
+  app.cli.add_command(export)
@@ -1,4 +1,5 @@
 import logging
+import re
 from os import environ
 from pathlib import Path
 from sys import exit
@@ -6,6 +7,13 @@ from tomllib import load
 
 from gsm import LOG
 
+SQLITE_PROFILE = {
+  'JOURNAL_MODE': 'WAL',
+  'SYNCHRONOUS': 'NORMAL',
+  'BUSY_TIMEOUT': 5000,
+  'MMAP_SIZE': None,
+  'CACHE_SIZE': None,
+}
 
 def configure(app):
 
@@ -25,8 +33,23 @@ def configure(app):
 
   app.config['GITLAB_ENDPOINT'] = CONFS['gitlab']['ENDPOINT']
   app.config['GITLAB_TOKEN'] = CONFS['gitlab']['TOKEN']
-  app.config['GITLAB_GROUP'] = CONFS['gitlab']['GROUP']
-  app.config['GITLAB_BASEURL'] = CONFS['gitlab']['BASEURL']
+  app.config['GITLAB_GROUP'] = CONFS['gitlab'].get('GROUP')
+  app.config['GITLAB_BASEURL'] = CONFS['gitlab'].get('BASEURL')
+  if 'courses' not in CONFS and not (app.config['GITLAB_GROUP'] and app.config['GITLAB_BASEURL']):
+    exit(f'Config file {environ["GSM_CONFIG_FILE"]} missing [gitlab] GROUP or BASEURL')
+  app.config['GITLAB_CONCURRENCY'] = CONFS['gitlab'].get('CONCURRENCY', 1)
+  app.config['GITLAB_BACKEND'] = CONFS['gitlab'].get('BACKEND', 'rest')
+  if app.config['GITLAB_BACKEND'] not in ('rest', 'graphql'):
+    exit(f'Config file {environ["GSM_CONFIG_FILE"]} has an unknown [gitlab] BACKEND: {app.config["GITLAB_BACKEND"]}')
+  app.config['GITLAB_GRAPHQL_PAGE_SIZE'] = CONFS['gitlab'].get('GRAPHQL_PAGE_SIZE', 20)
+  app.config['GITLAB_GRAPHQL_PIPELINES_PAGE_SIZE'] = CONFS['gitlab'].get('GRAPHQL_PIPELINES_PAGE_SIZE', 50)
+  app.config['GITLAB_WEBHOOK_TOKEN'] = CONFS['gitlab'].get('WEBHOOK_TOKEN')
+  app.config['GITLAB_POLL_ACTIVE_INTERVAL'] = CONFS['gitlab'].get('POLL_ACTIVE_INTERVAL', 60)
+  app.config['GITLAB_POLL_DORMANT_INTERVAL'] = CONFS['gitlab'].get('POLL_DORMANT_INTERVAL', 3600)
+  app.config['GITLAB_POLL_ACTIVE_WINDOW'] = CONFS['gitlab'].get('POLL_ACTIVE_WINDOW', 86400)
+  app.config['GITLAB_POLL_MAX_SOLUTIONS'] = CONFS['gitlab'].get('POLL_MAX_SOLUTIONS', 0)
+  app.config['GITLAB_DISCOVERY_INTERVAL'] = CONFS['gitlab'].get('DISCOVERY_INTERVAL', 600)
+  app.config['GITLAB_SYNC_MAX_AGE'] = CONFS['gitlab'].get('SYNC_MAX_AGE', 86400)
 
   dbfile = Path(app.instance_path) / 'gsm.sqlite'
   if 'GSM_SQLITE_DATABASE_FILE' in environ:
@@ -36,4 +59,39 @@ def configure(app):
   app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + str(dbfile.absolute())
   LOG.info('Using database %s', app.config['SQLALCHEMY_DATABASE_URI'])
 
+  app.config['SQLITE_PRAGMAS'] = {'foreign_keys': 'ON'} | {
+    pragma.lower(): CONFS['environment'].get(f'SQLITE_{pragma}', default)
+    for pragma, default in SQLITE_PROFILE.items()
+    if CONFS['environment'].get(f'SQLITE_{pragma}', default) is not None
+  }
+  app.config['GITLAB_REQUEST_BUDGET'] = CONFS['gitlab'].get('REQUEST_BUDGET', 0)
+  app.config['GITLAB_MAX_RETRIES'] = CONFS['gitlab'].get('MAX_RETRIES', 5)
+  app.config['GITLAB_BACKOFF'] = CONFS['gitlab'].get('BACKOFF', 1.0)
+  app.config['GITLAB_CACHE_FILE'] = str(dbfile.with_name(dbfile.stem + '-cache.sqlite').absolute())
+  app.config['GITLAB_CACHE_SIZE'] = int(CONFS['gitlab'].get('CACHE_SIZE', 0) * 2**20)
+  app.config['COMMIT_BATCH_SIZE'] = CONFS['environment'].get('COMMIT_BATCH_SIZE', 100)
+  app.config['METRICS_REPORT_FILE'] = CONFS['environment'].get('METRICS_REPORT_FILE', str(dbfile.with_name(dbfile.stem + '-report.json').absolute()))
+  app.config['PAGE_CACHE_SIZE'] = CONFS['environment'].get('PAGE_CACHE_SIZE', 128)
+  app.config['FRAGMENT_CACHE_SIZE'] = CONFS['environment'].get('FRAGMENT_CACHE_SIZE', 10000)
+
+  app.config['COURSES'] = {}
+  for name, course in CONFS.get('courses', {}).items():
+    if not re.fullmatch(r'[\w-]+', name):
+      exit(f'Config file {environ["GSM_CONFIG_FILE"]} has an invalid course name (use letters, digits, _ and -): {name}')
+    missing = {'GROUP', 'BASEURL'} - set(course.keys())
+    if missing:
+      exit(f'Config file {environ["GSM_CONFIG_FILE"]} course {name} missing keys: {missing}')
+    course_dbfile = Path(course['SQLITE_DATABASE_FILE']) if 'SQLITE_DATABASE_FILE' in course else dbfile.with_name(f'{dbfile.stem}-{name}.sqlite')
+    app.config['COURSES'][name] = {
+      'COURSE': name,
+      'GITLAB_GROUP': course['GROUP'],
+      'GITLAB_BASEURL': course['BASEURL'],
+      'GITLAB_ENDPOINT': course.get('ENDPOINT', app.config['GITLAB_ENDPOINT']),
+      'GITLAB_TOKEN': course.get('TOKEN', app.config['GITLAB_TOKEN']),
+      'GITLAB_WEBHOOK_TOKEN': course.get('WEBHOOK_TOKEN', app.config['GITLAB_WEBHOOK_TOKEN']),
+      'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(course_dbfile.absolute()),
+      'METRICS_REPORT_FILE': str(course_dbfile.with_name(course_dbfile.stem + '-report.json').absolute()),
+    }
+    LOG.info('Course %s using database %s', name, app.config['COURSES'][name]['SQLALCHEMY_DATABASE_URI'])
+
   app.config.from_mapping(CONFS['flask'])
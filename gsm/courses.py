@@ -0,0 +1,27 @@
+from flask import Blueprint, Flask, current_app, render_template
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+
+bp = Blueprint('courses', __name__)
+
+
+@bp.route('/')
+def index():
+  return render_template('courses.html', courses = current_app.extensions['gsm_courses'])
+
+def init_courses(app):
+  """Mounts an app for every course under /<course>, each with the settings of its [courses.<course>] table.
+
+  Course apps share the configuration and the code of the app, but have
+  their own database, admin views, caches and webhook token.
+  """
+  from gsm import init_course
+  courses = {}
+  for name, settings in app.config['COURSES'].items():
+    course = Flask(app.import_name, instance_path = app.instance_path)
+    course.config.from_mapping(app.config)
+    course.config.from_mapping(settings)
+    init_course(course)
+    courses[name] = course
+  app.extensions['gsm_courses'] = courses
+  app.register_blueprint(bp)
+  app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {f'/{name}': course for name, course in courses.items()})
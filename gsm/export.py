@@ -0,0 +1,106 @@
+import csv
+from importlib.util import find_spec
+from io import StringIO
+from itertools import groupby, islice
+
+from flask import Blueprint, Response, abort, stream_with_context
+
+from gsm.models import Exercise, Pipeline, Solution, Student, db
+
+FORMATS = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+FIELDS = ('status', 'success', 'count')
+BATCH_SIZE = 1000
+
+bp = Blueprint('export', __name__)
+
+
+def available_formats():
+  return [fmt for fmt in FORMATS if fmt != 'parquet' or find_spec('pyarrow')]
+
+def gradebook(session):
+  """Returns the header and the rows of the students × exercises matrix.
+
+  Every row has the name of a student followed, for every exercise, by the
+  status and the number of successful and total tests of the latest
+  pipeline of the student's solution (None if there is none). The rows are
+  streamed from a single query, one student after the other.
+  """
+  exercises = session.execute(db.select(Exercise.id, Exercise.name).order_by(Exercise.name)).all()
+  header = ['student'] + [f'{name}_{field}' for _, name in exercises for field in FIELDS]
+  query = (
+    db.select(Student.name, Solution.exercise_id, Solution.status, Pipeline.summary_success, Pipeline.summary_count)
+    .select_from(Student)
+    .outerjoin(Solution, Solution.student_id == Student.id)
+    .outerjoin(Pipeline, Pipeline.id == Solution.latest_pipeline_id)
+    .order_by(Student.name, Solution.last_activity_at)
+    .execution_options(yield_per = BATCH_SIZE)
+  )
+  def rows():
+    for student, solutions in groupby(session.execute(query), lambda row: row.name):
+      latest = {solution.exercise_id: solution[2:] for solution in solutions}
+      yield [student] + [value for id, _ in exercises for value in latest.get(id, (None, ) * len(FIELDS))]
+  return header, rows()
+
+def csv_chunks(header, rows):
+  buffer = StringIO()
+  writer = csv.writer(buffer)
+  writer.writerow(header)
+  while batch := list(islice(rows, BATCH_SIZE)):
+    writer.writerows(batch)
+    yield buffer.getvalue().encode()
+    buffer.seek(0)
+    buffer.truncate()
+  yield buffer.getvalue().encode()
+
+class ChunkSink:
+  """A write-only file collecting what is written until drained."""
+
+  closed = False
+
+  def __init__(self):
+    self.chunks = []
+    self.position = 0
+
+  def write(self, data):
+    self.chunks.append(bytes(data))
+    self.position += len(data)
+    return len(data)
+
+  def tell(self):
+    return self.position
+
+  def flush(self):
+    pass
+
+  def close(self):
+    self.closed = True
+
+  def drain(self):
+    data = b''.join(self.chunks)
+    self.chunks = []
+    return data
+
+def parquet_chunks(header, rows):
+  import pyarrow
+  import pyarrow.parquet
+  schema = pyarrow.schema([(name, pyarrow.string() if name == 'student' or name.endswith('_status') else pyarrow.int64()) for name in header])
+  sink = ChunkSink()
+  with pyarrow.parquet.ParquetWriter(pyarrow.PythonFile(sink, mode = 'w'), schema) as writer:
+    while batch := list(islice(rows, BATCH_SIZE)):
+      writer.write_batch(pyarrow.RecordBatch.from_arrays([pyarrow.array(column, field.type) for column, field in zip(zip(*batch), schema)], schema = schema))
+      yield sink.drain()
+  yield sink.drain()
+
+def export_chunks(session, fmt):
+  """Yields the gradebook encoded in the given format, a batch of students at a time."""
+  header, rows = gradebook(session)
+  return (parquet_chunks if fmt == 'parquet' else csv_chunks)(header, rows)
+
+
+@bp.route('/export/gradebook.<fmt>')
+def download(fmt):
+  if fmt not in available_formats(): abort(404)
+  return Response(stream_with_context(export_chunks(db.session, fmt)), mimetype = FORMATS[fmt], headers = {'Content-Disposition': f'attachment; filename=gradebook.{fmt}'})
+
+def init_export(app):
+  app.register_blueprint(bp)
@@ -0,0 +1,108 @@
+from datetime import datetime
+
+from gitlab.exceptions import GitlabError
+
+PIPELINES = """
+fragment pipelines on PipelineConnection {
+  pageInfo { hasNextPage endCursor }
+  nodes {
+    id status sha createdAt updatedAt
+    user { username }
+    testReportSummary { total { count success failed skipped error } }
+    jobs(retried: false) { nodes { id name status duration runner { description } user { username } } }
+  }
+}
+"""
+
+GROUP_PROJECTS = """
+query GroupProjects($group: ID!, $after: String, $projects: Int!, $pipelines: Int!, $updatedAfter: Time) {
+  group(fullPath: $group) {
+    projects(includeSubgroups: true, first: $projects, after: $after) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        id name fullPath archived createdAt lastActivityAt
+        namespace { id }
+        pipelines(first: $pipelines, updatedAfter: $updatedAfter) { ...pipelines }
+      }
+    }
+  }
+}
+""" + PIPELINES
+
+PROJECT_PIPELINES = """
+query ProjectPipelines($project: ID!, $after: String, $pipelines: Int!, $updatedAfter: Time) {
+  project(fullPath: $project) {
+    pipelines(first: $pipelines, after: $after, updatedAfter: $updatedAfter) { ...pipelines }
+  }
+}
+""" + PIPELINES
+
+
+class GitlabGraphQLError(GitlabError):
+  pass
+
+
+def gid2id(gid):
+  return int(gid.rsplit('/', 1)[-1])
+
+def gqldate2obj(string):
+  if string is None: return None
+  return datetime.fromisoformat(string.removesuffix('Z')).replace(microsecond = 0, tzinfo = None)
+
+
+def query(gl, document, **variables):
+  response = gl.session.post(f'{gl.url}/api/graphql', json = dict(query = document, variables = variables), headers = {'Authorization': f'Bearer {gl.private_token}'}, timeout = gl.timeout)
+  if response.status_code != 200: raise GitlabGraphQLError(response.text, response.status_code)
+  result = response.json()
+  if result.get('errors'): raise GitlabGraphQLError('; '.join(error['message'] for error in result['errors']), response.status_code)
+  return result['data']
+
+def pipeline2dict(node):
+  summary = node['testReportSummary']['total'] if node['testReportSummary'] else {}
+  return dict(
+    id = gid2id(node['id']),
+    status = node['status'].lower(),
+    sha = node['sha'],
+    created_at = gqldate2obj(node['createdAt']),
+    updated_at = gqldate2obj(node['updatedAt']),
+    username = node['user']['username'] if node['user'] else None,
+    summary = {key: summary.get(key, 0) for key in ('count', 'success', 'failed', 'skipped', 'error')},
+    jobs = [dict(
+      id = gid2id(job['id']),
+      name = job['name'],
+      status = job['status'].lower(),
+      duration = job['duration'],
+      runner = job['runner']['description'] if job['runner'] else None,
+      username = job['user']['username'] if job['user'] else None
+    ) for job in node['jobs']['nodes']]
+  )
+
+def fetch_group(gl, group_path, updated_after = None, page_size = 20, pipelines_page_size = 50):
+  """Yields every project of the group (and its subgroups) as a dict, with its pipelines updated after the given date.
+
+  Projects are fetched page_size at a time, together with their first
+  pipelines_page_size pipelines (with users, test report summaries and
+  jobs); the remaining pipelines of a project, if any, are fetched with
+  further queries for that project only.
+  """
+  filters = dict(updatedAfter = updated_after.isoformat() + 'Z') if updated_after else {}
+  after = None
+  while True:
+    projects = query(gl, GROUP_PROJECTS, group = group_path, after = after, projects = page_size, pipelines = pipelines_page_size, **filters)['group']['projects']
+    for node in projects['nodes']:
+      pipelines = node['pipelines']
+      nodes = list(pipelines['nodes'])
+      while pipelines['pageInfo']['hasNextPage']:
+        pipelines = query(gl, PROJECT_PIPELINES, project = node['fullPath'], after = pipelines['pageInfo']['endCursor'], pipelines = pipelines_page_size, **filters)['project']['pipelines']
+        nodes.extend(pipelines['nodes'])
+      yield dict(
+        id = gid2id(node['id']),
+        name = node['name'],
+        archived = node['archived'],
+        student_id = gid2id(node['namespace']['id']),
+        created_at = gqldate2obj(node['createdAt']),
+        last_activity_at = gqldate2obj(node['lastActivityAt']),
+        pipelines = [pipeline2dict(pipeline) for pipeline in nodes]
+      )
+    if not projects['pageInfo']['hasNextPage']: break
+    after = projects['pageInfo']['endCursor']
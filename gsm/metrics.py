@@ -0,0 +1,194 @@
+import json
+import re
+from bisect import bisect_left
+from os import replace
+from pathlib import Path
+from threading import Lock
+from time import perf_counter
+from urllib.parse import urlsplit
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.interfaces import ExecuteStyle
+
+from gsm.models import db
+
+SECONDS_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+QUERIES_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Metrics:
+  """Counters and histograms identified by a name and some labels, rendered in the Prometheus text format.
+
+  The labels in `labels` are added to every series updated, so that the
+  metrics of different commands can be told apart once merged.
+  """
+
+  def __init__(self):
+    self.lock = Lock()
+    self.labels = {}
+    self.counters = {}
+    self.histograms = {}
+
+  def key(self, name, labels):
+    return name, tuple(sorted((self.labels | labels).items()))
+
+  def inc(self, name, value = 1, **labels):
+    key = self.key(name, labels)
+    with self.lock: self.counters[key] = self.counters.get(key, 0) + value
+
+  def observe(self, name, value, buckets = SECONDS_BUCKETS, **labels):
+    key = self.key(name, labels)
+    with self.lock:
+      if key not in self.histograms: self.histograms[key] = dict(buckets = list(buckets), counts = [0] * (len(buckets) + 1), sum = 0, count = 0)
+      histogram = self.histograms[key]
+      histogram['counts'][bisect_left(histogram['buckets'], value)] += 1
+      histogram['sum'] += value
+      histogram['count'] += 1
+
+  def clear(self, **labels):
+    with self.lock:
+      for series in self.counters, self.histograms:
+        for key in [key for key in series if labels.items() <= dict(key[1]).items()]: del series[key]
+
+  def snapshot(self, **labels):
+    with self.lock:
+      return dict(
+        counters = [dict(name = name, labels = dict(key), value = value) for (name, key), value in self.counters.items() if labels.items() <= dict(key).items()],
+        histograms = [
+          dict(name = name, labels = dict(key), buckets = list(histogram['buckets']), counts = list(histogram['counts']), sum = histogram['sum'], count = histogram['count'])
+          for (name, key), histogram in self.histograms.items() if labels.items() <= dict(key).items()
+        ]
+      )
+
+  def merge(self, snapshot):
+    with self.lock:
+      for counter in snapshot['counters']:
+        key = counter['name'], tuple(sorted(counter['labels'].items()))
+        self.counters[key] = self.counters.get(key, 0) + counter['value']
+      for histogram in snapshot['histograms']:
+        key = histogram['name'], tuple(sorted(histogram['labels'].items()))
+        self.histograms[key] = {k: histogram[k] for k in ('buckets', 'counts', 'sum', 'count')}
+
+  def to_prometheus(self):
+    def series(name, labels, **extra):
+      labels = ','.join(f'{k}="{v}"' for k, v in list(labels) + list(extra.items()))
+      return f'{name}{{{labels}}}' if labels else name
+    lines, typed = [], set()
+    with self.lock:
+      for (name, labels), value in sorted(self.counters.items()):
+        if name not in typed: lines.append(f'# TYPE {name} counter')
+        typed.add(name)
+        lines.append(f'{series(name, labels)} {value}')
+      for (name, labels), histogram in sorted(self.histograms.items()):
+        if name not in typed: lines.append(f'# TYPE {name} histogram')
+        typed.add(name)
+        cumulative = 0
+        for bound, count in zip(histogram['buckets'] + ['+Inf'], histogram['counts']):
+          cumulative += count
+          lines.append(f'{series(name + "_bucket", labels, le = bound)} {cumulative}')
+        lines.append(f'{series(name + "_sum", labels)} {histogram["sum"]}')
+        lines.append(f'{series(name + "_count", labels)} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Metrics()
+
+
+def course_labels():
+  """Returns the course label of the metrics recorded in the app context of a course (none without [courses])."""
+  course = current_app.config.get('COURSE') if has_app_context() else None
+  return {'course': course} if course else {}
+
+def endpoint(url):
+  return re.sub(r'/\d+', '/:id', urlsplit(url).path.removeprefix('/api/v4'))
+
+def record_response(response, *args, **kwargs):
+  name = endpoint(response.request.url)
+  REGISTRY.inc('gsm_gitlab_requests_total', endpoint = name, status = response.status_code)
+  REGISTRY.observe('gsm_gitlab_request_seconds', response.elapsed.total_seconds(), endpoint = name)
+  if not getattr(response, 'from_cache', False): REGISTRY.inc('gsm_gitlab_received_bytes_total', len(response.content), endpoint = name)
+
+def instrument_session(session):
+  session.hooks['response'].append(record_response)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+  if has_request_context() and 'gsm_queries' in g: g.gsm_queries += 1
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def count_rows(conn, cursor, statement, parameters, context, executemany):
+  """Counts the rows written by the statement.
+
+  Inserts with RETURNING (as the ORM flushes) run in batches whose rowcount
+  is 0, so their rows are counted (once, at the first batch) from the
+  parameters of the whole statement.
+  """
+  if context.compiled is None or not (context.isinsert or context.isupdate or context.isdelete): return
+  operation = 'insert' if context.isinsert else 'update' if context.isupdate else 'delete'
+  if context.execute_style is ExecuteStyle.INSERTMANYVALUES:
+    if getattr(context, 'gsm_rows_counted', False): return
+    context.gsm_rows_counted = True
+    rows = len(context.compiled_parameters)
+  else:
+    rows = cursor.rowcount if cursor.rowcount >= 0 else len(parameters) if executemany else 1
+  REGISTRY.inc('gsm_db_rows_total', rows, table = context.compiled.statement.table.name, operation = operation, **course_labels())
+
+
+@event.listens_for(db.session, 'before_flush')
+def start_flush(session, flush_context, instances):
+  session.info['flush_started'] = perf_counter()
+
+@event.listens_for(db.session, 'after_flush_postexec')
+def end_flush(session, flush_context):
+  if 'flush_started' in session.info: REGISTRY.observe('gsm_db_flush_seconds', perf_counter() - session.info.pop('flush_started'), **course_labels())
+
+@event.listens_for(db.session, 'before_commit', insert = True)
+def start_commit(session):
+  session.info['commit_started'] = perf_counter()
+
+@event.listens_for(db.session, 'after_commit')
+def end_commit(session):
+  if 'commit_started' in session.info: REGISTRY.observe('gsm_db_commit_seconds', perf_counter() - session.info.pop('commit_started'), **course_labels())
+
+
+def write_report(path, command, started_at, seconds, **labels):
+  path = Path(path)
+  try:
+    reports = json.loads(path.read_text())
+  except (FileNotFoundError, ValueError):
+    reports = {}
+  reports[command] = dict(started_at = started_at, seconds = seconds, metrics = REGISTRY.snapshot(command = command, **labels))
+  temporary = path.with_suffix('.tmp')
+  temporary.write_text(json.dumps(reports, indent = 2))
+  replace(temporary, path)
+
+def read_reports(path):
+  try:
+    return json.loads(Path(path).read_text())
+  except (FileNotFoundError, ValueError):
+    return {}
+
+
+def init_metrics(app):
+
+  @app.before_request
+  def start_page():
+    g.gsm_started = perf_counter()
+    g.gsm_queries = 0
+
+  @app.after_request
+  def end_page(response):
+    if 'gsm_started' in g and request.endpoint != 'metrics':
+      REGISTRY.observe('gsm_page_seconds', perf_counter() - g.gsm_started, endpoint = request.endpoint, **course_labels())
+      REGISTRY.observe('gsm_page_queries', g.gsm_queries, QUERIES_BUCKETS, endpoint = request.endpoint, **course_labels())
+    return response
+
+  @app.route('/metrics')
+  def metrics():
+    merged = Metrics()
+    merged.merge(REGISTRY.snapshot(**course_labels()))
+    for report in read_reports(app.config['METRICS_REPORT_FILE']).values(): merged.merge(report['metrics'])
+    return merged.to_prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
@@ -1,8 +1,8 @@
 from typing import List
 
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import DateTime, ForeignKey, Integer, String, event, func, select
-from sqlalchemy.engine import Engine
+from sqlalchemy import JSON, Boolean, DateTime, ForeignKey, Index, Integer, String, event, func, select, update
+from sqlalchemy.dialects.sqlite import insert as upsert
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.ext.hybrid import hybrid_property
 from gsm import LOG
@@ -13,11 +13,15 @@ class Base(DeclarativeBase):
 
 db = SQLAlchemy(model_class=Base)
 
-@event.listens_for(Engine, 'connect')
-def set_sqlite_pragma(dbapi_connection, connection_record):
-  cursor = dbapi_connection.cursor()
-  cursor.execute('PRAGMA foreign_keys = ON')
-  cursor.close()
+def bind_sqlite_pragmas(app):
+  """Sets the SQLITE_PRAGMAS of the app on every connection its engine opens, even outside of an app context (say, by worker threads)."""
+  pragmas = {'foreign_keys': 'ON'} | app.config.get('SQLITE_PRAGMAS', {})
+  with app.app_context(): engine = db.engine
+  @event.listens_for(engine, 'connect')
+  def set_sqlite_pragma(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in pragmas.items(): cursor.execute(f'PRAGMA {pragma} = {value}')
+    cursor.close()
 
 class Student(db.Model):
   id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -32,10 +36,10 @@ class Student(db.Model):
     return select(func.count(Solution.id)).where(Solution.student_id == Student.id).scalar_subquery()
   @hybrid_property
   def num_pipelines(self):
-    return sum(len(s.pipelines) for s in self.solutions)
+    return sum(s.num_pipelines for s in self.solutions)
   @num_pipelines.expression
   def num_pipelines(cls):
-    return select(func.count(Pipeline.id)).join(Solution).where(Solution.student_id == Student.id).scalar_subquery()
+    return select(func.coalesce(func.sum(Solution.num_pipelines), 0)).where(Solution.student_id == Student.id).scalar_subquery()
   def __repr__(self):
     return self.name
   
@@ -43,79 +47,136 @@ class Exercise(db.Model):
   id: Mapped[int] = mapped_column(Integer, primary_key=True)
   name: Mapped[str] = mapped_column(String, unique=True, nullable=False)
   solutions: Mapped[List['Solution']] = relationship(back_populates='exercise')
-  @hybrid_property
-  def num_solutions(self):
-    return len([s for s in self.solutions if s.num_pipelines > 0])
-  @num_solutions.expression
-  def num_solutions(cls):
-    return select(func.count(Solution.id)).where(Solution.exercise_id == Exercise.id, Solution.num_pipelines > 0).scalar_subquery()
-  @hybrid_property
-  def num_successful_solutions(self):
-    return len([s for s in self.solutions if s.status == 'success'])
-  @num_successful_solutions.expression
-  def num_successful_solutions(cls):
-    return select(func.count(Solution.id)).where(Solution.exercise_id == Exercise.id, Solution.status == 'success').scalar_subquery()
-
-
+  num_solutions: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
+  num_successful_solutions: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
   def __repr__(self):
     return self.name
 
 class Solution(db.Model):
+  __table_args__ = (Index('ix_solution_exercise_id_status', 'exercise_id', 'status'), )
   id: Mapped[int] = mapped_column(Integer, primary_key=True)
   exercise_id: Mapped[int] = mapped_column(ForeignKey('exercise.id'))
   exercise: Mapped[Exercise] = relationship(back_populates='solutions')
-  student_id: Mapped[int] = mapped_column(ForeignKey('student.id', ondelete='CASCADE'))
+  student_id: Mapped[int] = mapped_column(ForeignKey('student.id', ondelete='CASCADE'), index=True)
   student: Mapped[Student] = relationship(back_populates='solutions')
   created_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
-  last_activity_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+  last_activity_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False, index=True)
   pipelines: Mapped[List['Pipeline']] = relationship(back_populates='solution', order_by = 'desc(Pipeline.created_at)', cascade='all, delete', passive_deletes=True)
-  @hybrid_property
-  def num_succeses(self):
-    return self.pipelines[0].summary_success if self.pipelines else None
-  @num_succeses.expression
-  def num_succeses(cls):
-    return select(Pipeline.summary_success).where(Pipeline.solution_id == Solution.id).order_by(Pipeline.id.desc()).limit(1).scalar_subquery()
-  @hybrid_property
-  def status(self):
-    return self.pipelines[0].status if self.pipelines else None
-  @status.expression
-  def status(cls):
-    return select(Pipeline.status).where(Pipeline.solution_id == Solution.id).order_by(Pipeline.id.desc()).limit(1).scalar_subquery()
-  @hybrid_property
-  def num_pipelines(self):
-    return len(self.pipelines)
-  @num_pipelines.expression
-  def num_pipelines(cls):
-    return select(func.count(Pipeline.id)).where(Pipeline.solution_id == Solution.id).scalar_subquery()
+  latest_pipeline_id: Mapped[int] = mapped_column(Integer, nullable=True)
+  latest_pipeline: Mapped['Pipeline'] = relationship(primaryjoin='foreign(Solution.latest_pipeline_id) == Pipeline.id', viewonly=True)
+  status: Mapped[str] = mapped_column(String, nullable=True, index=True)
+  num_succeses: Mapped[int] = mapped_column(Integer, nullable=True)
+  num_pipelines: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0', index=True)
   def __repr__(self):
     return f'{self.exercise.name}@{self.last_activity_at} ({self.student.name})'
 
+class SolutionSync(db.Model):
+  __versioned__ = False
+  solution_id: Mapped[int] = mapped_column(ForeignKey('solution.id', ondelete='CASCADE'), primary_key=True)
+  last_activity_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+  synced_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+  pending: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+
 class DiscardedPipeline(db.Model):
   id: Mapped[int] = mapped_column(Integer, primary_key=True)
 
 class Pipeline(db.Model):
+  __table_args__ = (Index('ix_pipeline_solution_id_id', 'solution_id', 'id'), )
   id: Mapped[int] = mapped_column(Integer, primary_key=True)
   solution_id: Mapped[int] = mapped_column(ForeignKey('solution.id', ondelete='CASCADE'))
   solution: Mapped[Solution] = relationship(back_populates='pipelines')
   status: Mapped[str] = mapped_column(String, nullable=False)
-  created_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+  created_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False, index=True)
   sha: Mapped[str] = mapped_column(String, nullable=False)
   summary_count: Mapped[int] = mapped_column(Integer)
   summary_success: Mapped[int] = mapped_column(Integer)
   summary_failed: Mapped[int] = mapped_column(Integer)
   summary_skipped: Mapped[int] = mapped_column(Integer)
   summary_error: Mapped[int] = mapped_column(Integer)
+  jobs_complete: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False, server_default='0', index=True)
   jobs: Mapped[List['Job']] = relationship(back_populates='pipeline', cascade='all, delete', passive_deletes=True)
   def __repr__(self):
     return f'{self.solution} @ {self.created_at}'
 
+class SolutionProgress(db.Model):
+  solution_id: Mapped[int] = mapped_column(ForeignKey('solution.id', ondelete='CASCADE'), primary_key=True)
+  solution: Mapped[Solution] = relationship()
+  first_pipeline_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+  first_success_at: Mapped[DateTime] = mapped_column(DateTime, nullable=True, index=True)
+  pipelines_to_success: Mapped[int] = mapped_column(Integer, nullable=True)
+
 class Job(db.Model):
   id: Mapped[int] = mapped_column(Integer, primary_key=True)
-  pipeline_id: Mapped[int] = mapped_column(ForeignKey('pipeline.id', ondelete='CASCADE'))
+  pipeline_id: Mapped[int] = mapped_column(ForeignKey('pipeline.id', ondelete='CASCADE'), index=True)
   pipeline: Mapped[Pipeline] = relationship(back_populates='jobs')
   status: Mapped[str] = mapped_column(String, nullable=False)
   name: Mapped[str] = mapped_column(String, nullable=False)
   runner: Mapped[str] = mapped_column(String, nullable=True)
   duration: Mapped[int] = mapped_column(Integer, nullable=True)
   def __repr__(self):
-    return f'{self.name} {self.status}'
\ No newline at end of file
+    return f'{self.name} {self.status}'
+
+def refresh_solutions(session, ids = None):
+  ids = None if ids is None else list(ids)
+  chunks = [None] if ids is None else [ids[i:i + 500] for i in range(0, len(ids), 500)]
+  for chunk in chunks:
+    where = [] if chunk is None else [Solution.id.in_(chunk)]
+    session.execute(update(Solution).where(*where).values(
+      latest_pipeline_id = select(func.max(Pipeline.id)).where(Pipeline.solution_id == Solution.id).scalar_subquery(),
+      num_pipelines = select(func.count(Pipeline.id)).where(Pipeline.solution_id == Solution.id).scalar_subquery()
+    ).execution_options(synchronize_session = False))
+    session.execute(update(Solution).where(*where).values(
+      status = select(Pipeline.status).where(Pipeline.id == Solution.latest_pipeline_id).scalar_subquery(),
+      num_succeses = select(Pipeline.summary_success).where(Pipeline.id == Solution.latest_pipeline_id).scalar_subquery()
+    ).execution_options(synchronize_session = False))
+    where = [] if chunk is None else [Solution.id.in_(chunk)]
+    statement = upsert(SolutionProgress).from_select(['solution_id', 'first_pipeline_at', 'first_success_at'], select(
+      Solution.id,
+      select(func.min(Pipeline.created_at)).where(Pipeline.solution_id == Solution.id).scalar_subquery(),
+      select(func.min(Pipeline.created_at)).where(Pipeline.solution_id == Solution.id, Pipeline.status == 'success').scalar_subquery()
+    ).where(Solution.num_pipelines > 0, *where))
+    session.execute(statement.on_conflict_do_update(index_elements = ['solution_id'], set_ = {name: statement.excluded[name] for name in ('first_pipeline_at', 'first_success_at', 'pipelines_to_success')}))
+    where = [] if chunk is None else [SolutionProgress.solution_id.in_(chunk)]
+    session.execute(update(SolutionProgress).where(*where).values(
+      pipelines_to_success = select(func.count(Pipeline.id)).where(Pipeline.solution_id == SolutionProgress.solution_id, Pipeline.created_at <= SolutionProgress.first_success_at).scalar_subquery()
+    ).where(SolutionProgress.first_success_at.is_not(None)).execution_options(synchronize_session = False))
+    where = [] if chunk is None else [Exercise.id.in_(select(Solution.exercise_id).where(Solution.id.in_(chunk)))]
+    session.execute(update(Exercise).where(*where).values(
+      num_solutions = select(func.count(Solution.id)).where(Solution.exercise_id == Exercise.id, Solution.num_pipelines > 0).scalar_subquery(),
+      num_successful_solutions = select(func.count(Solution.id)).where(Solution.exercise_id == Exercise.id, Solution.status == 'success').scalar_subquery()
+    ).execution_options(synchronize_session = False))
+
+class WebhookEvent(db.Model):
+  __versioned__ = False
+  id: Mapped[int] = mapped_column(Integer, primary_key=True)
+  event: Mapped[str] = mapped_column(String, nullable=False)
+  payload: Mapped[dict] = mapped_column(JSON, nullable=False)
+  received_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False, server_default=func.current_timestamp())
+  attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
+
+class DataVersion(db.Model):
+  id: Mapped[int] = mapped_column(Integer, primary_key=True)
+  version: Mapped[int] = mapped_column(Integer, nullable=False)
+
+def data_version(session):
+  return session.scalar(select(DataVersion.version)) or 0
+
+@event.listens_for(db.session, 'after_flush')
+def mark_flushed(session, flush_context):
+  if any(getattr(instance, '__versioned__', True) for instance in (*session.new, *session.dirty, *session.deleted)): session.info['changed'] = True
+
+@event.listens_for(db.session, 'do_orm_execute')
+def mark_executed(state):
+  if not (state.is_insert or state.is_update or state.is_delete): return
+  if state.bind_mapper is None or getattr(state.bind_mapper.class_, '__versioned__', True): state.session.info['changed'] = True
+
+@event.listens_for(db.session, 'before_commit')
+def bump_data_version(session):
+  session.flush()
+  if not session.info.pop('changed', False): return
+  statement = upsert(DataVersion.__table__).values(id = 1, version = 1)
+  session.connection().execute(statement.on_conflict_do_update(index_elements = ['id'], set_ = {'version': DataVersion.__table__.c.version + 1}))
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_changes(session):
+  session.info.pop('changed', None)
@@ -0,0 +1,156 @@
+from concurrent.futures import FIRST_COMPLETED, wait
+from datetime import timedelta
+from heapq import heappop, heappush
+from itertools import count
+from random import uniform
+from threading import Lock
+from time import monotonic, sleep, time
+
+from gitlab.exceptions import GitlabError
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, RequestException, Timeout
+
+TRANSIENT_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+class RequestScheduler:
+  """Spreads requests to stay within a budget (per minute), pausing when GitLab reports the rate limit is almost exhausted."""
+
+  def __init__(self, budget = 0, max_retries = 5, backoff = 1.0, reserve = 1):
+    self.interval = 60 / budget if budget else 0
+    self.max_retries = max_retries
+    self.backoff = backoff
+    self.reserve = reserve
+    self.lock = Lock()
+    self.next_slot = self.paused_until = monotonic()
+    self.requests = self.retries = 0
+    self.throttled = 0.0
+
+  def acquire(self):
+    with self.lock:
+      now = monotonic()
+      slot = max(now, self.next_slot, self.paused_until)
+      self.next_slot = slot + self.interval
+      self.requests += 1
+    if slot > now: self.wait(slot - now)
+
+  def observe(self, response):
+    remaining, reset = response.headers.get('RateLimit-Remaining'), response.headers.get('RateLimit-Reset')
+    if remaining is None or reset is None or int(remaining) > self.reserve: return
+    self.pause(int(reset) - time())
+
+  def retry(self, attempt, retry_after = None):
+    delay = float(retry_after) if retry_after and retry_after.isdigit() else self.backoff * 2 ** attempt * uniform(.5, 1.5)
+    with self.lock: self.retries += 1
+    if retry_after: self.pause(delay)
+    self.wait(delay)
+
+  def pause(self, delay):
+    with self.lock: self.paused_until = max(self.paused_until, monotonic() + delay)
+
+  def wait(self, delay):
+    with self.lock: self.throttled += delay
+    sleep(delay)
+
+  def stats(self):
+    return f'Requests: {self.requests} ({self.retries} retries), throttled for {self.throttled:.1f}s'
+
+
+class SchedulingAdapter(HTTPAdapter):
+  """Sends every request through a RequestScheduler, retrying connection errors and transient statuses with jittered exponential backoff."""
+
+  def __init__(self, *args, scheduler = None, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.scheduler = scheduler
+
+  def send(self, request, **kwargs):
+    if self.scheduler is None: return super().send(request, **kwargs)
+    for attempt in count():
+      self.scheduler.acquire()
+      try:
+        response = super().send(request, **kwargs)
+      except (ConnectionError, Timeout):
+        if attempt >= self.scheduler.max_retries: raise
+        self.scheduler.retry(attempt)
+        continue
+      self.scheduler.observe(response)
+      if response.status_code not in TRANSIENT_STATUSES or attempt >= self.scheduler.max_retries: return response
+      retry_after = response.headers.get('Retry-After')
+      response.close()
+      self.scheduler.retry(attempt, retry_after)
+
+
+class PollSchedule:
+  """Solutions ordered (in a heap) by when they are next due to be polled.
+
+  Solutions active within the last window are due again after active,
+  dormant ones after dormant; rescheduling a solution just pushes a new entry,
+  the stale ones are skipped when popped.
+  """
+
+  def __init__(self, active, dormant, window):
+    self.active = timedelta(seconds = active)
+    self.dormant = timedelta(seconds = dormant)
+    self.window = timedelta(seconds = window)
+    self.heap = []
+    self.due_at = {}
+
+  def __len__(self):
+    return len(self.due_at)
+
+  def interval(self, last_activity_at, now, pending = False):
+    return self.active if pending or now - last_activity_at < self.window else self.dormant
+
+  def schedule(self, id, due_at):
+    self.due_at[id] = due_at
+    heappush(self.heap, (due_at, id))
+
+  def pop_due(self, now, limit = None):
+    due = []
+    while self.heap and self.heap[0][0] <= now and (limit is None or len(due) < limit):
+      due_at, id = heappop(self.heap)
+      if self.due_at.get(id) != due_at: continue
+      del self.due_at[id]
+      due.append(id)
+    return due
+
+  def next_due(self):
+    while self.heap and self.due_at.get(self.heap[0][1]) != self.heap[0][0]: heappop(self.heap)
+    return self.heap[0][0] if self.heap else None
+
+
+class TaskQueue:
+  """Runs tasks on a thread pool yielding (item, result) as they complete.
+
+  Tasks failing with a GitlabError or a RequestException (a connection
+  error or timeout that outlived the retries) are requeued once all the
+  others are done. The label and error of those failing again are collected
+  in failed.
+  """
+
+  def __init__(self, pool):
+    self.pool = pool
+    self.pending = {}
+    self.requeued = []
+    self.failed = []
+    self.submitted = 0
+
+  def submit(self, label, item, function, *args):
+    self.pending[self.pool.submit(function, *args)] = (label, item, function, args, 0)
+    self.submitted += 1
+
+  def __iter__(self):
+    while self.pending or self.requeued:
+      if not self.pending:
+        for label, item, function, args in self.requeued: self.pending[self.pool.submit(function, *args)] = (label, item, function, args, 1)
+        self.requeued = []
+      done, _ = wait(self.pending, return_when = FIRST_COMPLETED)
+      for future in done:
+        label, item, function, args, attempt = self.pending.pop(future)
+        try:
+          result = future.result()
+        except (GitlabError, RequestException) as error:
+          if attempt: self.failed.append((label, error))
+          else: self.requeued.append((label, item, function, args))
+          continue
+        yield item, result
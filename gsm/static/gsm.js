@@ -0,0 +1,13 @@
+function gsmLoadPipelines(button) {
+  button.disabled = true;
+  fetch(button.dataset.url)
+    .then(response => response.json())
+    .then(page => {
+      button.previousElementSibling.insertAdjacentHTML('beforeend', page.html);
+      if (page.next) {
+        button.dataset.url = page.next;
+        button.disabled = false;
+      } else button.remove();
+    })
+    .catch(() => { button.disabled = false; });
+}
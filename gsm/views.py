@@ -1,14 +1,20 @@
-from datetime import datetime
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from threading import Lock
 
-from flask import current_app, url_for
-from flask_admin import Admin, AdminIndexView
-from flask_admin.contrib.sqla import ModelView
-from humanize import naturaltime, precisedelta
+from flask import Response, abort, current_app, jsonify, request, session, url_for
+from flask_admin import Admin, AdminIndexView, BaseView, expose
+from flask_admin.contrib.sqla import ModelView, tools
+from humanize import naturaldelta, naturaltime, precisedelta
 from markupsafe import Markup
+from sqlalchemy.orm import joinedload, selectinload
 
+from flask_admin.menu import MenuLink
 from flask_admin.model.template import LinkRowAction
 
 from gsm import __version__
+from gsm.analytics import exercise_stats, exercise_timeline
+from gsm.export import available_formats
 from gsm.models import *
 
 SATUS2ICON = {
@@ -21,6 +27,76 @@ SATUS2ICON = {
   None: '❓'
 }
 
+DETAIL_PIPELINES = 20
+
+class PageCache:
+  """Rendered list pages, keyed by URL and dropped as soon as the data version changes.
+
+  Only pages of GET requests without flashed messages are served from the
+  cache, and only successful ones not touching the session (or setting other
+  cookies) are stored, so that redirects and errors are rendered every time.
+  """
+
+  def __init__(self, size):
+    self.size = size
+    self.lock = Lock()
+    self.pages = OrderedDict()
+    self.version = None
+
+  def get(self, key, version, render):
+    if self.size == 0 or request.method != 'GET' or '_flashes' in session: return render()
+    with self.lock:
+      if version != self.version:
+        self.pages.clear()
+        self.version = version
+      if key in self.pages:
+        self.pages.move_to_end(key)
+        return self.pages[key]
+    page = render()
+    if not self.cacheable(page): return page
+    with self.lock:
+      if version == self.version:
+        self.pages[key] = page
+        if len(self.pages) > self.size: self.pages.popitem(last = False)
+    return page
+
+  @staticmethod
+  def cacheable(page):
+    if session.modified: return False
+    if isinstance(page, str): return True
+    return isinstance(page, Response) and page.status_code == 200 and 'Set-Cookie' not in page.headers
+
+class FragmentCache:
+  """Rendered HTML fragments of finished pipelines, keyed by kind and pipeline id.
+
+  Stored pipelines never change once all their jobs have been fetched, so
+  their fragments are never invalidated, just evicted when least recently used.
+  """
+
+  def __init__(self, size):
+    self.size = size
+    self.lock = Lock()
+    self.fragments = OrderedDict()
+
+  def __contains__(self, key):
+    with self.lock: return key in self.fragments
+
+  def get(self, key, render):
+    if self.size == 0: return render()
+    with self.lock:
+      if key in self.fragments:
+        self.fragments.move_to_end(key)
+        return self.fragments[key]
+    fragment = render()
+    with self.lock:
+      self.fragments[key] = fragment
+      if len(self.fragments) > self.size: self.fragments.popitem(last = False)
+    return fragment
+
+def pipeline_fragment(kind, pipeline, render):
+  if not pipeline.jobs_complete: return render()
+  return current_app.extensions['gsm_fragment_cache'].get((kind, pipeline.id), render)
+
 class ROModelView(ModelView):
   extra_css = ['https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.2/css/all.min.css']
   can_view_details = True
@@ -32,20 +108,53 @@ class ROModelView(ModelView):
   column_type_formatters = {
     datetime: lambda w, v: Markup(f'<span title="{v}">{naturaltime(v)}</span>')
   }
+  query_options = ()
+  details_query_options = ()
+  def get_query(self):
+    return super().get_query().options(*self.query_options)
+  def get_one(self, id):
+    return self.session.get(self.model, tools.iterdecode(id), options = self.details_query_options)
+  @expose('/')
+  def index_view(self):
+    return current_app.extensions['gsm_page_cache'].get((self.endpoint, request.full_path), data_version(self.session), super().index_view)
+
+def solution2gitlaburl(sol):
+  return f'{current_app.config["GITLAB_BASEURL"]}{sol.student.name}/{sol.exercise.name}'
 
 def pipeline2gitlaburl(sol, id):
-  student = sol.student.name
-  exercise = sol.exercise.name
-  return f'{current_app.config["GITLAB_BASEURL"]}{student}/{exercise}/-/pipelines/{id}'
+  return f'{solution2gitlaburl(sol)}/-/pipelines/{id}'
 
 def job2gitlaburl(job, id):
-  solution = job.pipeline.solution 
-  student = solution.student.name
-  exercise = solution.exercise.name
-  return f'{current_app.config["GITLAB_BASEURL"]}{student}/{exercise}/-/jobs/{id}'
+  return f'{solution2gitlaburl(job.pipeline.solution)}/-/jobs/{id}'
+
+def jobs2str(jobs, url):
+  return '&nbsp;&nbsp;'.join(f'<span title="{j.status}">{SATUS2ICON[j.status]}</span>&nbsp;<a href="{url}/-/jobs/{j.id}">{j.name}</a>' for j in jobs)
+
+def jobs2items(jobs, url):
+  return '<ul>' + '\n'.join(f'<li><span title="{j.status}">{SATUS2ICON[j.status]} <a href="{url}/-/jobs/{j.id}">{j.name}</a>' for j in jobs) + '</ul>'
 
-def jobs2str(jobs):
-  return '&nbsp;&nbsp;'.join(f'<span title="{j.status}">{SATUS2ICON[j.status]}</span>&nbsp;<a href="{job2gitlaburl(j, j.id)}">{j.name}</a>' for j in jobs)
+def pipeline2item(pipeline, url):
+  return f'<li><span title="{pipeline.status}">{SATUS2ICON[pipeline.status]} <a href="{url}/-/pipelines/{pipeline.id}">{pipeline.created_at}</a> {jobs2str(pipeline.jobs, url)}'
+
+def pipeline_items(session, solution, before = None):
+  """Returns the list items of the (at most DETAIL_PIPELINES) latest pipelines of the solution older than before, and the id to ask the next ones before (None if there are no more).
+
+  The jobs are loaded, with a single query, only for pipelines whose item is not cached.
+  """
+  query = select(Pipeline).where(Pipeline.solution_id == solution.id, *([] if before is None else [Pipeline.id < before]))
+  pipelines = session.scalars(query.order_by(Pipeline.id.desc()).limit(DETAIL_PIPELINES + 1)).all()
+  more = len(pipelines) > DETAIL_PIPELINES
+  pipelines = pipelines[:DETAIL_PIPELINES]
+  cache = current_app.extensions['gsm_fragment_cache']
+  missing = [p.id for p in pipelines if not p.jobs_complete or ('item', p.id) not in cache]
+  if missing: session.scalars(select(Pipeline).where(Pipeline.id.in_(missing)).options(selectinload(Pipeline.jobs))).all()
+  url = solution2gitlaburl(solution)
+  return [pipeline_fragment('item', p, lambda p = p: pipeline2item(p, url)) for p in pipelines], pipelines[-1].id if more else None
+
+def pipelines2html(solution):
+  items, before = pipeline_items(db.session, solution)
+  more = f'<button class="btn btn-sm btn-secondary" data-url="{url_for(".pipelines_view", id = solution.id, before = before)}" onclick="gsmLoadPipelines(this)">More pipelines</button>' if before else ''
+  return '<ul>' + '\n'.join(items) + '</ul>' + more
 
 def pipeline2progress(pipeline):
   if pipeline.summary_count == 0: return """
@@ -83,6 +192,8 @@ class AllStudentView(ROModelView):
   column_sortable_list = column_filters = column_list = ['name', 'num_solutions', 'num_pipelines', 'created_at']
   column_default_sort = ('name', False)
   column_details_list = ['name', 'created_at', 'solutions']
+  query_options = (selectinload(Student.solutions), )
+  details_query_options = (selectinload(Student.solutions).joinedload(Solution.exercise), )
   column_extra_row_actions = [
     LinkRowAction('fa fa-arrow-up-right-from-square', lambda s, i, r: current_app.config["GITLAB_BASEURL"] + r.name),
   ]
@@ -123,18 +234,30 @@ class AllSolutionView(ROModelView):
     LinkRowAction('fa fa-arrow-up-right-from-square', lambda s, i, r: current_app.config["GITLAB_BASEURL"] + r.student.name + '/' + r.exercise.name),
   ]
   column_details_list = column_list + ['pipelines']
+  query_options = details_query_options = (joinedload(Solution.student), joinedload(Solution.exercise))
   column_formatters_detail = {
-    'pipelines': lambda v, c, m, p: Markup('<ul>' + '\n'.join(f'<li><span title="{p.status}">{SATUS2ICON[p.status]} <a href="{pipeline2gitlaburl(p.solution, p.id)}">{p.created_at}</a> {jobs2str(p.jobs)}' for p in m.pipelines) + '</ul>')
+    'pipelines': lambda v, c, m, p: Markup(pipelines2html(m))
   }
+  @property
+  def extra_js(self):
+    return [url_for('static', filename = 'gsm.js')]
+  @expose('/pipelines/')
+  def pipelines_view(self):
+    id = request.args.get('id', type = int)
+    solution = self.session.get(Solution, id, options = self.details_query_options) if id else None
+    if solution is None: abort(404)
+    items, before = pipeline_items(self.session, solution, request.args.get('before', type = int))
+    return jsonify(html = '\n'.join(items), next = url_for('.pipelines_view', id = solution.id, before = before) if before else None)
 
 class SolutionView(AllSolutionView):
-  column_list = AllSolutionView.column_list[:-1] + ['num_succeses', 'pipelines']
+  column_list = AllSolutionView.column_list[:-1] + ['num_succeses', 'latest_pipeline']
   column_filters = AllSolutionView.column_filters + ['num_succeses']
   column_sortable_list = AllSolutionView.column_sortable_list + ['num_succeses']
-  column_labels = AllSolutionView.column_labels | {'pipelines': 'Progress'}
+  column_labels = AllSolutionView.column_labels | {'latest_pipeline': 'Progress'}
   column_formatters = {
-    'pipelines': lambda v, c, m, p: Markup(pipeline2progress(m.pipelines[0]))
+    'latest_pipeline': lambda v, c, m, p: Markup(pipeline2progress(m.latest_pipeline))
   }
+  query_options = AllSolutionView.query_options + (joinedload(Solution.latest_pipeline), )
   def get_query(self):
     return super().get_query().filter(self.model.num_pipelines>0)
   def get_count_query(self):
@@ -155,12 +278,13 @@ class PipelineView(ROModelView):
     'summary_error': '# Error'
   }
   column_formatters = {
-    'progress': lambda v, c, m, p: Markup(pipeline2progress(m)),
-    'jobs': lambda v, c, m, p: Markup(jobs2str(m.jobs))
+    'progress': lambda v, c, m, p: Markup(pipeline_fragment('progress', m, lambda: pipeline2progress(m))),
+    'jobs': lambda v, c, m, p: Markup(pipeline_fragment('jobs', m, lambda: jobs2str(m.jobs, solution2gitlaburl(m.solution))))
   }
   column_formatters_detail = {
-    'jobs': lambda v, c, m, p: Markup('<ul>' + '\n'.join(f'<li><span title="{j.status}">{SATUS2ICON[j.status]} <a href="{job2gitlaburl(j, j.id)}">{j.name}</a>' for j in m.jobs) + '</ul>')
+    'jobs': lambda v, c, m, p: Markup(pipeline_fragment('job_items', m, lambda: jobs2items(m.jobs, solution2gitlaburl(m.solution))))
   }
+  query_options = details_query_options = (joinedload(Pipeline.solution).joinedload(Solution.student), joinedload(Pipeline.solution).joinedload(Solution.exercise), selectinload(Pipeline.jobs))
   column_extra_row_actions = [
     LinkRowAction('fa fa-arrow-up-right-from-square', lambda s, i, r: pipeline2gitlaburl(r.solution, i)),
     LinkRowAction('fa fa-file-lines', lambda s, i, r: url_for('solution.details_view', id = r.solution.id)),
@@ -180,20 +304,41 @@ class JobView(ROModelView):
   column_extra_row_actions = [
     LinkRowAction('fa fa-arrow-up-right-from-square', lambda s, i, r: job2gitlaburl(r, i))
   ]
+  query_options = (joinedload(Job.pipeline).joinedload(Pipeline.solution).joinedload(Solution.student), joinedload(Job.pipeline).joinedload(Pipeline.solution).joinedload(Solution.exercise))
+
+class AnalyticsView(BaseView):
+  @expose('/')
+  def index(self):
+    def render():
+      exercise = db.session.scalar(db.select(Exercise).where(Exercise.name == request.args['exercise'])) if 'exercise' in request.args else None
+      timeline = exercise_timeline(db.session, exercise.id) if exercise else []
+      return self.render('analytics.html', stats = exercise_stats(db.session), exercise = exercise, timeline = timeline, naturaldelta = lambda hours: naturaldelta(timedelta(hours = hours)))
+    return current_app.extensions['gsm_page_cache'].get((self.endpoint, request.full_path), data_version(db.session), render)
+
+class ExportLink(MenuLink):
+  def __init__(self, fmt):
+    super().__init__(name = f'Gradebook ({fmt.upper()})', endpoint = 'export.download', category = 'Export')
+    self.fmt = fmt
+  def get_url(self):
+    return url_for(self.endpoint, fmt = self.fmt)
 
 def init_admin(app):
   admin = Admin(
     app, 
-    name = f'GitLab Students Monitor [{__version__}]', 
+    name = f'GitLab Students Monitor [{__version__}]' + (f' {app.config["COURSE"]}' if app.config.get('COURSE') else ''), 
     template_mode = 'bootstrap4',
     index_view = AdminIndexView(name = 'Home', url = '/'),
   )
+  app.extensions['gsm_page_cache'] = PageCache(app.config['PAGE_CACHE_SIZE'])
+  app.extensions['gsm_fragment_cache'] = FragmentCache(app.config['FRAGMENT_CACHE_SIZE'])
   admin.add_view(StudentView(Student, db.session))
   admin.add_view(ExerciseView(Exercise, db.session))
   admin.add_view(SolutionView(Solution, db.session))
   admin.add_view(PipelineView(Pipeline, db.session))
+  admin.add_view(AnalyticsView(name = 'Analytics', endpoint = 'analytics'))
   admin.add_view(AllStudentView(Student, db.session, category = 'Details', endpoint = 'allstudent', name = 'All Students'))
   admin.add_view(AllSolutionView(Solution, db.session, category = 'Details', endpoint = 'allsolution', name = 'All Solutions'))
   admin.add_view(JobView(Job, db.session, category = 'Details'))
+  for fmt in available_formats(): admin.add_link(ExportLink(fmt))
   return admin
 
@@ -0,0 +1,36 @@
+from hmac import compare_digest
+
+from flask import Blueprint, abort, current_app, request
+
+from gsm.metrics import REGISTRY, course_labels
+from gsm.models import WebhookEvent, db
+
+EVENTS = frozenset(['Pipeline Hook'])
+
+bp = Blueprint('webhooks', __name__)
+
+def hooked_pipeline(payload):
+  """Returns the id, project id, status and user name of the pipeline of a Pipeline Hook event, raising KeyError or TypeError if the payload lacks them."""
+  attributes = payload['object_attributes']
+  return attributes['id'], payload['project']['id'], attributes['status'], payload['user']['username']
+
+@bp.route('/webhooks/gitlab', methods = ['POST'])
+def gitlab():
+  token = current_app.config['GITLAB_WEBHOOK_TOKEN']
+  if not token: abort(404)
+  if not compare_digest(request.headers.get('X-Gitlab-Token', ''), token): abort(403)
+  event = request.headers.get('X-Gitlab-Event')
+  REGISTRY.inc('gsm_webhook_events_total', event = event, **course_labels())
+  if event not in EVENTS: return '', 204
+  payload = request.get_json(silent = True)
+  if not isinstance(payload, dict): abort(400)
+  try:
+    hooked_pipeline(payload)
+  except (KeyError, TypeError):
+    abort(400)
+  db.session.add(WebhookEvent(event = event, payload = payload))
+  db.session.commit()
+  return '', 202
+
+def init_webhooks(app):
+  app.register_blueprint(bp)
@@ -0,0 +1,45 @@
+"""Number of SQL statements run to render every list and detail view.
+
+The views are rendered on a database filled by the synthetic course generator
+(as benchmarks.run does) with the page and fragment caches disabled; since the
+numbers do not depend on the size of the course, a change in them means some
+relationship is loaded lazily again (or a query was added on purpose, and the
+expected numbers need updating).
+"""
+
+from tempfile import TemporaryDirectory
+
+import pytest
+from sqlalchemy import event
+
+from benchmarks.common import make_app
+from benchmarks.fake_gitlab import Course
+from benchmarks.run import PAGES
+from benchmarks.synthetic import generate
+
+QUERIES = dict(zip(PAGES, [4, 3, 3, 4, 4, 3, 3, 2, 2, 4, 4, 2]))
+
+
+@pytest.fixture(scope = 'module')
+def client():
+  from gsm.models import db
+  with TemporaryDirectory() as workdir:
+    app = make_app(workdir)
+    app.extensions['gsm_page_cache'].size = 0
+    app.extensions['gsm_fragment_cache'].size = 0
+    with app.app_context():
+      db.create_all()
+      generate(Course(5, 3, 3, 2))
+      queries = [0]
+      event.listen(db.engine, 'before_cursor_execute', lambda *args: queries.__setitem__(0, queries[0] + 1))
+    client = app.test_client()
+    client.queries = queries
+    yield client
+
+
+@pytest.mark.parametrize('page', PAGES)
+def test_queries(client, page):
+  client.queries[0] = 0
+  response = client.get(page)
+  assert response.status_code == 200
+  assert client.queries[0] == QUERIES[page]